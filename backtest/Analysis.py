@@ -1,22 +1,33 @@
 import pandas as pd
 import numpy as np
+from collections import Counter
 from typing import List, Dict
 
+TRADE_COLUMNS = ["order_id", "symbol", "side", "price", "quantity", "fee", "timestamp"]
+
 
 class BacktestAnalysis:
     """回测分析"""
     
     def __init__(self, results_df: pd.DataFrame, trades: List[Dict], 
-                 initial_cash: float, risk_free_rate: float = 0.0):
+                 initial_cash: float, risk_free_rate: float = 0.0,
+                 periods_per_year: int = 252):
         self.results_df = results_df.copy()
         self.trades = trades
+        # 买卖笔数一次遍历统计好，print_summary / get_metrics 直接使用
+        sides = Counter(t['side'] for t in trades)
+        self.buy_count = sides['BUY']
+        self.sell_count = sides['SELL']
         self.initial_cash = initial_cash
-        self.risk_free_rate = risk_free_rate
+        self.risk_free_rate = risk_free_rate  # 年化无风险利率
+        self.periods_per_year = periods_per_year
         
         # 计算收益率
-        self.results_df['equity_pct'] = self.results_df['equity'] / self.initial_cash * 100
+        self.equity_pct = np.asarray(self.results_df['equity'], dtype=np.float64) / self.initial_cash * 100
+        self.results_df['equity_pct'] = self.equity_pct
         if not self.results_df.empty:
-            self.results_df['price_pct'] = self.results_df['close'] / self.results_df['close'].iloc[0] * 100
+            close = np.asarray(self.results_df['close'], dtype=np.float64)
+            self.results_df['price_pct'] = close / close[0] * 100
         
         self.calculate_metrics()
 
@@ -25,22 +36,27 @@ class BacktestAnalysis:
         if self.results_df.empty:
             return
         
+        eq = self.equity_pct
+
         # 计算最大回撤
-        self.results_df['max_equity'] = self.results_df['equity_pct'].cummax()
-        self.results_df['drawdown'] = self.results_df['equity_pct'] - self.results_df['max_equity']
-        self.max_drawdown = self.results_df['drawdown'].min()
+        max_equity = np.maximum.accumulate(eq)
+        drawdown = eq - max_equity
+        self.results_df['max_equity'] = max_equity
+        self.results_df['drawdown'] = drawdown
+        self.max_drawdown = drawdown.min()
         
         # 计算总收益率
-        self.total_return_pct = self.results_df['equity_pct'].iloc[-1] - 100
+        self.total_return_pct = eq[-1] - 100
         
         # 计算夏普比率
-        returns = self.results_df['equity_pct'].pct_change().dropna()
-        if len(returns) > 0:
-            N = returns.count()
-            daily_rf = self.risk_free_rate / N
+        returns = np.diff(eq) / eq[:-1]
+        returns = returns[np.isfinite(returns)]
+        N = returns.size
+        if N > 1:
+            period_rf = self.risk_free_rate / self.periods_per_year
             r_bar = returns.mean()
-            sigma = returns.std()
-            self.sharpe_ratio = (r_bar - daily_rf) / sigma * np.sqrt(N) if sigma > 0 else 0
+            sigma = returns.std(ddof=1)
+            self.sharpe_ratio = (r_bar - period_rf) / sigma * np.sqrt(N) if sigma > 0 else 0
         else:
             self.sharpe_ratio = 0
 
@@ -55,10 +71,12 @@ class BacktestAnalysis:
         print(f"交易次数: {len(self.trades)}")
         
         if self.trades:
-            buy_trades = [t for t in self.trades if t['side'] == 'BUY']
-            sell_trades = [t for t in self.trades if t['side'] == 'SELL']
-            print(f"买入次数: {len(buy_trades)}")
-            print(f"卖出次数: {len(sell_trades)}")
+            print(f"买入次数: {self.buy_count}")
+            print(f"卖出次数: {self.sell_count}")
+
+    def trades_df(self) -> pd.DataFrame:
+        """成交记录（DataFrame 形式），由成交列表一次性构造"""
+        return pd.DataFrame.from_records(self.trades, columns=TRADE_COLUMNS)
 
     def get_metrics(self) -> Dict:
         """获取所有指标"""
@@ -69,6 +87,6 @@ class BacktestAnalysis:
             'max_drawdown': self.max_drawdown,
             'sharpe_ratio': self.sharpe_ratio,
             'total_trades': len(self.trades),
-            'buy_trades': len([t for t in self.trades if t['side'] == 'BUY']),
-            'sell_trades': len([t for t in self.trades if t['side'] == 'SELL'])
+            'buy_trades': self.buy_count,
+            'sell_trades': self.sell_count
         }
\ No newline at end of file
@@ -1,5 +1,6 @@
+import numpy as np
 import pandas as pd
-from typing import Dict
+from typing import Dict, List
 from .Strategy import Strategy
 from .Broker import Broker
 from .data_adapter import DataAdapter
@@ -16,43 +17,168 @@ class Backtesting:
         self.broker = Broker(initial_cash=initial_cash, fee_rate=fee_rate, 
                            slippage=slippage)
         self.strategy.set_broker(self.broker)
-        self.history = []
+
+        # 一次性完成列名映射并按列抽取为 ndarray，避免在逐 bar 循环中构造 Series
+        required = DataAdapter.get_required_columns()
+        renamed = DataAdapter.adapt_dataframe(df, required)
+        if renamed.empty:
+            # 空数据（adapt_dataframe 原样返回）：补齐必需列，各数组长度为 0，run() 只产生空结果
+            renamed = renamed.reindex(columns=list(dict.fromkeys([*renamed.columns, *required])))
+        renamed = self.strategy.prepare(renamed)
+        self._cols = list(renamed.columns)
+        self._arrays = [renamed[c].to_numpy() for c in self._cols]
+        self._index = renamed.index.to_list()  # 保留 Timestamp，策略侧打印/记录不受影响
+        self.bars = DataAdapter.to_bars(renamed)
+        self._close_arr = self.bars.close
+        self._dt_arr = self.bars.datetime
+        self._symbol_arr = self.bars.symbol
+        self._frame = renamed  # on_bars 不适用时 run() 才用它向策略要信号 bar
+
+        # 逐 bar 记录按列预分配（SoA），持仓只在发生成交时记录
+        n = len(renamed)
+        index_dtype = renamed.index.dtype
+        ts_dtype = index_dtype if isinstance(index_dtype, np.dtype) and index_dtype.kind == "M" else object
+        self._ts = np.empty(n, dtype=ts_dtype)
+        self._equity = np.empty(n, dtype=np.float64)
+        self._cash = np.empty(n, dtype=np.float64)
+        self._close = np.empty(n, dtype=np.float64)
+        self._n = 0
+        self._position_log: List[Dict] = []
 
     def run(self):
         """运行回测"""
         self.strategy.on_init()
         
-        for idx, bar in self.data.iterrows():
-            # 使用数据适配器创建标准的bar字典
-            bar_dict = DataAdapter.create_bar_dict(bar)
-            
-            self.strategy.on_bar(bar_dict)
-            trades = self.broker.execute_orders(bar_dict)
-            
+        # 依次尝试：批量信号（on_bars）→ 只回放信号 bar（signal_bars）→ 逐 bar 运行
+        signals = self.strategy.on_bars(self._close_arr, self._dt_arr, self._symbol_arr)
+        if signals is not None:
+            self._run_on_bars(np.asarray(signals, dtype=np.float64))
+        else:
+            # signal_bars 只在 on_bars 不适用时才计算
+            signal_bars = self.strategy.signal_bars(self._frame)
+            if signal_bars is None:
+                self._run_from(0)
+            else:
+                self._run_signals(signal_bars)
+        
+        self.strategy.on_finish()
+
+    def _run_from(self, start: int):
+        """从第 start 根 bar 起逐 bar 运行到结束"""
+        cols = self._cols
+        rows = zip(*(a[start:] for a in self._arrays))
+        for ts, row in zip(self._index[start:], rows):
+            bar_dict = dict(zip(cols, row))
+            bar_dict["datetime"] = ts
+            self._step(bar_dict)
+
+    def _run_signals(self, bars):
+        """只在策略给出的信号 bar 上调用 on_bar，其余 bar 批量记录"""
+        cols = self._cols
+        for i in bars:
+            i = int(i)
+            self._fill_idle(i)
+            bar_dict = {c: a[i] for c, a in zip(cols, self._arrays)}
+            bar_dict["datetime"] = self._index[i]
+            self._step(bar_dict)
+            if self.broker.get_open_orders():
+                # 有订单未成交，信号序列的前提不再成立：之后逐 bar 运行
+                self._run_from(i + 1)
+                return
+        self._fill_idle(len(self._index))
+
+    def _run_on_bars(self, signals: np.ndarray):
+        """按 on_bars 返回的信号数组运行：只在信号 bar 上下单撮合，不调用 on_bar"""
+        cols = self._cols
+        for i in np.flatnonzero(signals):
+            i = int(i)
+            self._fill_idle(i)
+            bar_dict = {c: a[i] for c, a in zip(cols, self._arrays)}
+            bar_dict["datetime"] = self._index[i]
+            trades = self.broker.execute_signal(bar_dict, float(signals[i]))
             for trade in trades:
                 self.strategy.on_trade(trade)
-            
+            if trades:
+                self.record_positions(trades)
             self.record(bar_dict)
+            if self.broker.get_open_orders():
+                self._run_from(i + 1)
+                return
+        self._fill_idle(len(self._index))
+
+    def _step(self, bar_dict: Dict):
+        """处理一根 bar：策略 → 撮合 → 成交回调 → 记录"""
+        self.strategy.on_bar(bar_dict)
+        trades = self.broker.execute_orders(bar_dict)
         
-        self.strategy.on_finish()
+        for trade in trades:
+            self.strategy.on_trade(trade)
+        
+        if trades:
+            self.record_positions(trades)
+        self.record(bar_dict)
+
+    def _fill_idle(self, stop: int):
+        """记录 [_n, stop) 这些无操作的 bar：现金与持仓不变，权益只随收盘价变化"""
+        start = self._n
+        if stop <= start:
+            return
+        close = self._close_arr[start:stop]
+        cash = self.broker.cash
+        quantity = self.broker.total_quantity
+        self._ts[start:stop] = self._index[start:stop]
+        self._equity[start:stop] = cash + quantity * close if quantity > 0 else cash
+        self._cash[start:stop] = cash
+        self._close[start:stop] = close
+        self._n = stop
 
     def record(self, bar: Dict):
         """记录回测数据"""
+        # 计算持仓市值：持仓总量由 broker 在成交时维护，这里 O(1)
         equity = self.broker.cash
+        if self.broker.total_quantity > 0:
+            equity += self.broker.total_quantity * bar["close"]
         
-        # 计算持仓市值
-        for symbol, pos in self.broker.positions.items():
-            if pos["quantity"] > 0:
-                equity += pos["quantity"] * bar["close"]
-        
-        self.history.append({
-            "timestamp": bar["datetime"],
-            "equity": equity,
-            "cash": self.broker.cash,
-            "close": bar["close"],
-            "positions": self.broker.positions.copy()
-        })
+        i = self._n
+        if i == len(self._equity):
+            self._grow()
+        self._ts[i] = bar["datetime"]
+        self._equity[i] = equity
+        self._cash[i] = self.broker.cash
+        self._close[i] = bar["close"]
+        self._n = i + 1
+
+    def record_positions(self, trades: List[Dict]):
+        """记录发生成交的标的在成交后的持仓"""
+        for symbol in dict.fromkeys(t["symbol"] for t in trades):
+            pos = self.broker.get_position(symbol)
+            self._position_log.append({
+                "timestamp": trades[0]["timestamp"],
+                "symbol": symbol,
+                "quantity": pos["quantity"],
+                "avg_price": pos["avg_price"]
+            })
+
+    def _grow(self):
+        """记录数超过预分配长度时扩容一倍"""
+        size = max(1, 2 * len(self._equity))
+        for name in ("_ts", "_equity", "_cash", "_close"):
+            old = getattr(self, name)
+            new = np.empty(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
 
     def results(self) -> pd.DataFrame:
         """获取回测结果"""
-        return pd.DataFrame(self.history)
\ No newline at end of file
+        n = self._n
+        return pd.DataFrame({
+            "timestamp": self._ts[:n],
+            "equity": self._equity[:n],
+            "cash": self._cash[:n],
+            "close": self._close[:n]
+        })
+
+    def positions(self) -> pd.DataFrame:
+        """获取持仓变动记录（每次成交后的持仓）"""
+        return pd.DataFrame(self._position_log,
+                            columns=["timestamp", "symbol", "quantity", "avg_price"])
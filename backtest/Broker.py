@@ -1,4 +1,70 @@
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+import numpy as np
+from ._kernels import SIDE_BUY, SIDE_SELL, run_fills
+
+
+# 订单类型 / 状态编码
+TYPE_MARKET, TYPE_LIMIT, TYPE_OTHER = 0, 1, -1
+STATUS_OPEN, STATUS_FILLED, STATUS_CANCELED = 0, 1, 2
+STATUS_NAMES = {STATUS_OPEN: "OPEN", STATUS_FILLED: "FILLED", STATUS_CANCELED: "CANCELED"}
+
+
+class _OrderBook:
+    """
+    订单簿：按列存储（SoA）的订单数组，订单 id 即下标。
+    数值字段放在 ndarray 里供撮合批量计算，字符串字段只在转换为 dict 时使用。
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.n = 0
+        self.side = np.empty(capacity, dtype=np.int8)
+        self.otype = np.empty(capacity, dtype=np.int8)
+        self.status = np.empty(capacity, dtype=np.int8)
+        self.price = np.empty(capacity, dtype=np.float64)
+        self.qty = np.empty(capacity, dtype=np.float64)
+        self.symbol_id = np.empty(capacity, dtype=np.int32)
+        self.labels: List[Tuple[str, str, str]] = []  # (side, symbol, type) 原始字符串
+
+    def add(self, side: str, symbol: str, symbol_id: int, price: float, qty: float,
+            order_type: str) -> int:
+        i = self.n
+        if i == len(self.side):
+            self._grow()
+        self.side[i] = SIDE_BUY if side == "BUY" else SIDE_SELL if side == "SELL" else 0
+        self.otype[i] = (TYPE_MARKET if order_type == "MARKET"
+                         else TYPE_LIMIT if order_type == "LIMIT" else TYPE_OTHER)
+        self.status[i] = STATUS_OPEN
+        self.price[i] = price
+        self.qty[i] = qty
+        self.symbol_id[i] = symbol_id
+        self.labels.append((side, symbol, order_type))
+        self.n = i + 1
+        return i
+
+    def _grow(self):
+        size = 2 * len(self.side)
+        for name in ("side", "otype", "status", "price", "qty", "symbol_id"):
+            old = getattr(self, name)
+            new = np.empty(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def open_indices(self) -> np.ndarray:
+        """未成交订单的下标（按提交顺序）"""
+        return np.flatnonzero(self.status[:self.n] == STATUS_OPEN)
+
+    def to_dict(self, i: int) -> Dict:
+        side, symbol, order_type = self.labels[i]
+        return {
+            "id": int(i),
+            "side": side,
+            "symbol": symbol,
+            "price": float(self.price[i]),
+            "quantity": float(self.qty[i]),
+            "type": order_type,
+            "status": STATUS_NAMES[int(self.status[i])]
+        }
 
 
 class Broker:
@@ -7,110 +73,201 @@ class Broker:
     def __init__(self, initial_cash: float = 100000, fee_rate: float = 0.0005, 
                  slippage: float = 0.0001):
         self.cash = initial_cash
-        self.positions: Dict[str, Dict] = {}  # {symbol: {"quantity": 0, "avg_price": 0}}
-        self.orders: List[Dict] = []
+        self._book = _OrderBook()
+        # 标的在首次出现时分配整数 id，持仓按 id 存在数组里，热路径不再做字符串哈希
+        self._symbol_ids: Dict[str, int] = {}
+        self._symbols: List[str] = []
+        self._pos_qty = np.zeros(8, dtype=np.float64)
+        self._pos_avg = np.zeros(8, dtype=np.float64)
+        self._pos_held = np.zeros(8, dtype=np.bool_)  # 是否出现过持仓（对应原 positions 的键）
         self.trades: List[Dict] = []
-        self.order_id = 0
         self.fee_rate = fee_rate
         self.slippage = slippage
+        self.total_quantity = 0.0  # 所有多头持仓数量之和，仅在持仓变化时更新
+
+    @property
+    def order_id(self) -> int:
+        """下一个订单 id"""
+        return self._book.n
+
+    @property
+    def positions(self) -> Mapping[str, Mapping]:
+        """
+        持仓快照（只读）：{symbol: {"quantity": ..., "avg_price": ...}}
+        持仓实际存在按 symbol_id 索引的数组里，这里每次现构造，外层与每个持仓都是只读映射，
+        写入会抛出 TypeError（旧版本返回的是可原地修改的内部 dict）。修改持仓请用 update_position。
+        """
+        return MappingProxyType({sym: MappingProxyType(self._position_dict(sid))
+                                 for sid, sym in enumerate(self._symbols) if self._pos_held[sid]})
+
+    @property
+    def orders(self) -> Tuple[Mapping, ...]:
+        """
+        全部订单快照（只读，仅供查看）：每个订单是只读映射，写入会抛出 TypeError。
+        订单实际存在 _OrderBook 的数组里；撤单请用 cancel_order。
+        """
+        return tuple(MappingProxyType(self._book.to_dict(i)) for i in range(self._book.n))
 
     def submit_order(self, side: str, symbol: str, price: float, qty: float, 
                     order_type: str) -> Dict:
         """提交订单"""
-        order = {
-            "id": self.order_id,
-            "side": side,
-            "symbol": symbol,
-            "price": price,
-            "quantity": qty,
-            "type": order_type,
-            "status": "OPEN"
-        }
-        self.order_id += 1
-        self.orders.append(order)
-        return order
+        i = self._book.add(side, symbol, self._symbol_id(symbol), price, qty, order_type)
+        return self._book.to_dict(i)
+
+    def execute_signal(self, bar: Dict, signal: float) -> List[Dict]:
+        """
+        在 bar 上执行一个批量信号（见 Strategy.on_bars），按收盘价下市价单并立即撮合：
+        signal > 0 用 signal 比例的现金买入，signal < 0 卖出 -signal 比例的持仓。
+        下单数量与 on_bar 里手动下单的算法一致，返回本根 bar 的成交。
+        """
+        symbol = bar["symbol"]
+        price = bar["close"]
+        if signal > 0:
+            qty = self.cash * signal / price
+            if qty > 0:
+                self.submit_order("BUY", symbol, price, qty, "MARKET")
+        elif signal < 0:
+            held = self.get_position(symbol)["quantity"]
+            if held > 0:
+                self.submit_order("SELL", symbol, price, held * -signal, "MARKET")
+        return self.execute_orders(bar)
 
     def cancel_order(self, order_id: int) -> bool:
         """取消订单"""
-        for order in self.orders:
-            if order["id"] == order_id and order["status"] == "OPEN":
-                order["status"] = "CANCELED"
-                return True
+        book = self._book
+        if 0 <= order_id < book.n and book.status[order_id] == STATUS_OPEN:
+            book.status[order_id] = STATUS_CANCELED
+            return True
         return False
 
     def get_open_orders(self, symbol: Optional[str] = None) -> List[Dict]:
         """获取未成交订单"""
-        return [o for o in self.orders if o["status"] == "OPEN" 
-                and (symbol is None or o["symbol"] == symbol)]
+        book = self._book
+        return [book.to_dict(i) for i in book.open_indices()
+                if symbol is None or book.labels[i][1] == symbol]
 
     def get_position(self, symbol: str) -> Dict:
         """获取持仓"""
-        return self.positions.get(symbol, {"quantity": 0, "avg_price": 0.0})
+        sid = self._symbol_ids.get(symbol)
+        if sid is None or not self._pos_held[sid]:
+            return {"quantity": 0, "avg_price": 0.0}
+        return self._position_dict(sid)
 
     def update_position(self, symbol: str, position: Dict):
         """更新持仓"""
-        self.positions[symbol] = position
+        sid = self._symbol_id(symbol)
+        self._pos_qty[sid] = position["quantity"]
+        self._pos_avg[sid] = position["avg_price"]
+        self._pos_held[sid] = True
+        self._refresh_total_quantity()
+
+    def _symbol_id(self, symbol: str) -> int:
+        """返回标的的整数 id，首次出现时分配并按需扩容持仓数组"""
+        sid = self._symbol_ids.get(symbol)
+        if sid is None:
+            sid = len(self._symbols)
+            self._symbol_ids[symbol] = sid
+            self._symbols.append(symbol)
+            if sid == len(self._pos_qty):
+                for name in ("_pos_qty", "_pos_avg", "_pos_held"):
+                    old = getattr(self, name)
+                    new = np.zeros(2 * len(old), dtype=old.dtype)
+                    new[:len(old)] = old
+                    setattr(self, name, new)
+        return sid
+
+    def _position_dict(self, sid: int) -> Dict:
+        return {"quantity": float(self._pos_qty[sid]), "avg_price": float(self._pos_avg[sid])}
+
+    def _refresh_total_quantity(self):
+        qty = self._pos_qty[:len(self._symbols)]
+        self.total_quantity = float(qty[qty > 0].sum())
 
     def get_account_info(self) -> Dict:
         """获取账户信息"""
-        return {"cash": self.cash, "positions": self.positions.copy()}
+        return {"cash": self.cash, "positions": dict(self.positions)}
+
+    def plan_fills(self, highs, lows, closes, side, price, otype) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        向量化判定订单能否成交
+
+        bar 行情（highs/lows/closes）与订单参数（side/price/otype）按 NumPy 规则广播，
+        例如 bar 传 (N, 1)、订单传 (M,) 即可一次算出 N 个 bar × M 个订单的成交情况。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (是否成交, 成交价)，未成交处成交价为 NaN
+        """
+        side = np.asarray(side)
+        otype = np.asarray(otype)
+        side_code = np.select([side == "BUY", side == "SELL"], [SIDE_BUY, SIDE_SELL], 0)
+        type_code = np.select([otype == "MARKET", otype == "LIMIT"], [TYPE_MARKET, TYPE_LIMIT],
+                              TYPE_OTHER)
+        return self._plan_fills(highs, lows, closes, side_code, price, type_code)
+
+    def _plan_fills(self, highs, lows, closes, side, price, otype) -> Tuple[np.ndarray, np.ndarray]:
+        """plan_fills 的编码版本：side / otype 为整数编码"""
+        is_buy = side == SIDE_BUY
+        is_sell = side == SIDE_SELL
+        price = np.asarray(price, dtype=np.float64)
+        highs = np.asarray(highs, dtype=np.float64)
+        lows = np.asarray(lows, dtype=np.float64)
+        closes = np.asarray(closes, dtype=np.float64)
+
+        # 市价单，用滑点价格
+        market_px = closes * np.where(is_buy, 1 + self.slippage, 1 - self.slippage)
+        # 限价单，在最高价和最低价之间判为能成交
+        limit_hit = (is_buy & (price >= lows)) | (is_sell & (price <= highs))
+
+        fill_px = np.where(otype == TYPE_MARKET, market_px,
+                           np.where((otype == TYPE_LIMIT) & limit_hit, price, np.nan))
+        return ~np.isnan(fill_px), fill_px
 
     def execute_orders(self, bar: Dict) -> List[Dict]:
         """执行订单"""
         trades = []
-        active_orders = self.get_open_orders()
-        
-        for order in active_orders:
-            symbol = order["symbol"]
-            match_price = None
-            filled = False
-
-            if order["type"] == "MARKET":
-                # 市价单，用滑点价格
-                match_price = bar["close"] * (1 + self.slippage if order["side"] == "BUY" 
-                                            else 1 - self.slippage)
-                filled = True
-
-            elif order["type"] == "LIMIT":
-                # 限价单，在最高价和最低价之间判为能成交
-                if (order["side"] == "BUY" and order["price"] >= bar["low"]) or \
-                   (order["side"] == "SELL" and order["price"] <= bar["high"]):
-                    match_price = order["price"]
-                    filled = True
-
-            if not filled:
-                continue
-
-            cost = match_price * order["quantity"]
-            fee = cost * self.fee_rate
-            pos = self.get_position(symbol)
-
-            if order["side"] == "BUY" and self.cash >= (cost + fee):
-                self.cash -= (cost + fee)
-                total_qty = pos["quantity"] + order["quantity"]
-                if total_qty > 0:
-                    pos["avg_price"] = (pos["avg_price"] * pos["quantity"] + 
-                                       match_price * order["quantity"]) / total_qty
-                pos["quantity"] = total_qty
-                order["status"] = "FILLED"
-
-            elif order["side"] == "SELL" and pos["quantity"] >= order["quantity"]:
-                self.cash += (cost - fee)
-                pos["quantity"] -= order["quantity"]
-                order["status"] = "FILLED"
-
-            if order["status"] == "FILLED":
-                self.update_position(symbol, pos)
-                trade = {
-                    "order_id": order["id"],
-                    "symbol": symbol,
-                    "side": order["side"],
-                    "price": match_price,
-                    "quantity": order["quantity"],
-                    "fee": fee,
-                    "timestamp": bar.get("datetime")  # 使用datetime字段作为时间戳
-                }
-                self.trades.append(trade)
-                trades.append(trade)
+        book = self._book
+        open_idx = book.open_indices()
+        if open_idx.size == 0:
+            return trades
+
+        side = book.side[open_idx]
+        order_qty = book.qty[open_idx]
+        can_fill, fill_px = self._plan_fills(
+            bar["high"], bar["low"], bar["close"],
+            side, book.price[open_idx], book.otype[open_idx],
+        )
+        if not can_fill.any():
+            return trades
+
+        # 持仓数组按 symbol_id 原地更新，交给编译内核顺序结算
+        n = open_idx.size
+        order_sid = book.symbol_id[open_idx]
+        filled = np.zeros(n, dtype=np.bool_)
+        fees = np.zeros(n, dtype=np.float64)
+
+        self.cash = float(run_fills(self.cash, self._pos_qty, self._pos_avg, side, order_sid,
+                                    can_fill, fill_px, order_qty, self.fee_rate,
+                                    filled, fees))
+
+        for i in np.flatnonzero(filled):
+            oid = int(open_idx[i])
+            side_label, symbol, _ = book.labels[oid]
+            self._pos_held[order_sid[i]] = True
+            book.status[oid] = STATUS_FILLED
+
+            trade = {
+                "order_id": oid,
+                "symbol": symbol,
+                "side": side_label,
+                "price": float(fill_px[i]),
+                "quantity": float(order_qty[i]),
+                "fee": float(fees[i]),
+                "timestamp": bar.get("datetime")  # 使用datetime字段作为时间戳
+            }
+            self.trades.append(trade)
+            trades.append(trade)
+
+        if trades:
+            self._refresh_total_quantity()
         
         return trades
\ No newline at end of file
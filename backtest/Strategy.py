@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
 
 
 class Strategy(ABC):
@@ -11,6 +13,35 @@ class Strategy(ABC):
     def set_broker(self, broker):
         self.broker = broker
 
+    def prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        回测开始前对整段数据做一次预处理（列名已是标准列名）。
+        可在这里向量化地预先计算指标并作为新列返回，新列会出现在每个 bar 字典里。
+        默认原样返回。
+        """
+        return df
+
+    def signal_bars(self, df: pd.DataFrame) -> Optional[np.ndarray]:
+        """
+        可选：返回 on_bar 可能下单的 bar 位置（升序整数数组），df 为 prepare 之后的数据。
+        前提是这些 bar 上提交的订单都当根成交；引擎只在这些 bar 上调用 on_bar，
+        其余 bar 直接按当前现金/持仓记录权益。一旦某个信号 bar 之后仍有未成交订单，
+        引擎从下一根 bar 起退回逐 bar 调用。
+        返回 None（默认）表示每根 bar 都调用 on_bar。
+        """
+        return None
+
+    def on_bars(self, close: np.ndarray, dt: np.ndarray,
+                symbols: np.ndarray) -> Optional[np.ndarray]:
+        """
+        可选的批量接口：回测开始时一次性传入整段 收盘价 / 时间 / 代码 数组，返回每根 bar 的信号（float 数组）：
+        > 0 用该比例的现金按收盘价市价买入；< 0 按该比例卖出当前持仓（-1 为全部卖出）；0 不操作。
+        实现后引擎不再调用 on_bar，只在信号 bar 上下单撮合，成交照常回调 on_trade；
+        若信号 bar 上的订单未能当根成交，引擎从下一根 bar 起退回逐 bar 调用 on_bar。
+        返回 None（默认）表示不使用批量接口。
+        """
+        return None
+
     @abstractmethod
     def on_init(self):
         """策略初始化"""
@@ -0,0 +1,168 @@
+"""
+回测热路径的数值内核
+
+所有函数只接受 NumPy 数组/标量，可被 numba 编译为本地代码；
+未安装 numba 时退化为普通 Python 函数，结果逐位一致（均不启用 fastmath），仅速度较慢。
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover - 取决于运行环境
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# 订单方向编码
+SIDE_BUY = 1
+SIDE_SELL = -1
+
+
+@njit(cache=True)
+def run_fills(cash, qty, avg_px, side, symbol_id, can_fill, fill_px, order_qty,
+              fee_rate, filled, fees):
+    """
+    按提交顺序逐笔结算可成交订单。
+    现金 / 均价是资金算术，不启用 fastmath：重排浮点运算顺序会让成交数量与权益曲线产生 ulp 级偏差。
+
+    Args:
+        cash: 当前现金
+        qty / avg_px: 按 symbol_id 索引的持仓数量 / 均价（原地修改）
+        side: 订单方向（SIDE_BUY / SIDE_SELL）
+        symbol_id: 订单对应的 symbol_id
+        can_fill: 行情上是否满足成交条件
+        fill_px: 成交价
+        order_qty: 订单数量
+        fee_rate: 手续费率
+        filled / fees: 输出，是否实际成交 / 手续费
+
+    Returns:
+        float: 结算后的现金
+    """
+    for i in range(side.shape[0]):
+        if not can_fill[i]:
+            continue
+
+        sid = symbol_id[i]
+        q = order_qty[i]
+        cost = fill_px[i] * q
+        fee = cost * fee_rate
+        fees[i] = fee
+
+        if side[i] == SIDE_BUY:
+            if cash >= cost + fee:
+                cash -= cost + fee
+                total_qty = qty[sid] + q
+                if total_qty > 0:
+                    avg_px[sid] = (avg_px[sid] * qty[sid] + fill_px[i] * q) / total_qty
+                qty[sid] = total_qty
+                filled[i] = True
+        elif side[i] == SIDE_SELL:
+            if qty[sid] >= q:
+                cash += cost - fee
+                qty[sid] -= q
+                filled[i] = True
+
+    return cash
+
+
+@njit(cache=True)
+def ma_cross_signals(ma_short, ma_long, signals):
+    """
+    均线交叉信号（与 MovingAverageStrategy.on_bar 的判断一致，假设每笔订单当根成交）：
+    空仓且短均线 > 长均线 → 1（买入）；持仓且短均线 < 长均线 → -1（卖出）；其余为 0。
+    长均线为 NaN（预热期）的 bar 不产生信号。不启用 fastmath，NaN 比较需保持 IEEE 语义。
+
+    Args:
+        ma_short / ma_long: 短 / 长均线
+        signals: 输出，int8 数组
+    """
+    holding = False
+    for i in range(ma_long.shape[0]):
+        s = ma_short[i]
+        l = ma_long[i]
+        if np.isnan(l):
+            continue
+        if not holding and s > l:
+            signals[i] = 1
+            holding = True
+        elif holding and s < l:
+            signals[i] = -1
+            holding = False
+
+
+@njit(cache=True, error_model="numpy")
+def ma_cross_backtest(close, ma_short, ma_long, cash, cash_fraction, fee_rate, slippage,
+                      equity, cash_curve, trade_bar, trade_side, trade_px, trade_qty, trade_fee):
+    """
+    单标的均线交叉策略的整段回测：信号判断与 ma_cross_signals 一致，下单数量与
+    Broker.execute_signal 一致，结算直接调用 run_fills（市价单按收盘价加减滑点当根成交），
+    因此与 Backtesting 的结果逐位一致。不启用 fastmath，NaN 比较需保持 IEEE 语义；
+    error_model="numpy" 使价格为 0 时与 NumPy 一样得到 inf 而不是抛出 ZeroDivisionError。
+
+    Args:
+        close: 收盘价（float64）
+        ma_short / ma_long: 短 / 长均线
+        cash: 初始资金
+        cash_fraction: 金叉时用于买入的资金比例
+        fee_rate / slippage: 手续费率 / 滑点
+        equity / cash_curve: 输出，逐 bar 权益 / 现金
+        trade_bar / trade_side / trade_px / trade_qty / trade_fee: 输出，逐笔成交的
+            bar 下标 / 方向（SIDE_BUY / SIDE_SELL）/ 成交价 / 数量 / 手续费
+
+    Returns:
+        Tuple[int, int]: (成交笔数, 资金不足、买单无法当根成交的 bar 下标；全部成交时为 -1)
+    """
+    # run_fills 的单订单入参，循环中复用
+    qty = np.zeros(1)
+    avg_px = np.zeros(1)
+    side = np.empty(1, dtype=np.int8)
+    symbol_id = np.zeros(1, dtype=np.int32)
+    can_fill = np.ones(1, dtype=np.bool_)
+    fill_px = np.empty(1)
+    order_qty = np.empty(1)
+    filled = np.empty(1, dtype=np.bool_)
+    fees = np.empty(1)
+
+    holding = False
+    n = 0
+    for i in range(close.shape[0]):
+        px = close[i]
+        s = ma_short[i]
+        l = ma_long[i]
+        order = False
+        if not np.isnan(l):
+            if not holding and s > l:
+                holding = True
+                q = cash * cash_fraction / px
+                if q > 0:
+                    side[0] = SIDE_BUY
+                    fill_px[0] = px * (1.0 + slippage)
+                    order_qty[0] = q
+                    order = True
+            elif holding and s < l:
+                holding = False
+                if qty[0] > 0:
+                    side[0] = SIDE_SELL
+                    fill_px[0] = px * (1.0 - slippage)
+                    order_qty[0] = qty[0]
+                    order = True
+        if order:
+            filled[0] = False
+            fees[0] = 0.0
+            cash = run_fills(cash, qty, avg_px, side, symbol_id, can_fill, fill_px, order_qty,
+                             fee_rate, filled, fees)
+            if not filled[0]:
+                return n, i
+            trade_bar[n] = i
+            trade_side[n] = side[0]
+            trade_px[n] = fill_px[0]
+            trade_qty[n] = order_qty[0]
+            trade_fee[n] = fees[0]
+            n += 1
+        equity[i] = cash + qty[0] * px if qty[0] > 0 else cash
+        cash_curve[i] = cash
+    return n, -1
@@ -2,8 +2,19 @@
 数据适配器 - 将数据库列名映射到回测框架标准列名
 """
 
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+
+class Bars(NamedTuple):
+    """按列存储（SoA）的整段 bar：每个字段一条连续数组，下标即 bar 序号"""
+    datetime: np.ndarray  # 索引为 tz-naive 时间时为 datetime64（保持原精度），否则为 object
+    close: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    volume: np.ndarray
+    symbol: np.ndarray
 
 
 class DataAdapter:
@@ -38,14 +49,25 @@ class DataAdapter:
         "时间": "time"
     }
     
+    # compact=True 时的列类型：价格收窄为 float32，成交额保持 float64
+    _DTYPES = {
+        "close": np.float32,
+        "high": np.float32,
+        "low": np.float32,
+        "amount": np.float64
+    }
+    
     @classmethod
-    def adapt_dataframe(cls, df: pd.DataFrame, required_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    def adapt_dataframe(cls, df: pd.DataFrame, required_columns: Optional[List[str]] = None,
+                        compact: bool = False) -> pd.DataFrame:
         """
         适配DataFrame，将数据库列名转换为标准列名
         
         Args:
             df: 原始数据DataFrame
             required_columns: 需要的标准列名列表
+            compact: 是否按 _DTYPES 收窄列类型。float32 约 7 位有效数字，
+                与 float64 的回测结果会有微小差异，因此默认不开启
             
         Returns:
             pd.DataFrame: 适配后的DataFrame
@@ -53,14 +75,8 @@ class DataAdapter:
         if df.empty:
             return df
         
-        # 创建列名映射字典
-        column_mapping = {}
-        for db_col, std_col in cls.STANDARD_COLUMNS.items():
-            if db_col in df.columns:
-                column_mapping[db_col] = std_col
-        
-        # 重命名列
-        adapted_df = df.rename(columns=column_mapping)
+        # 重命名列：映射表直接交给 rename（不存在的列自动忽略），只改列索引，不复制数据
+        adapted_df = df.rename(columns=cls.STANDARD_COLUMNS)
         
         # 如果指定了必需列，检查并填充缺失值
         if required_columns:
@@ -80,6 +96,10 @@ class DataAdapter:
                         else:
                             adapted_df[col] = "UNKNOWN"
         
+        if compact:
+            dtypes = {c: t for c, t in cls._DTYPES.items() if c in adapted_df.columns}
+            adapted_df = adapted_df.astype(dtypes, copy=False)
+        
         return adapted_df
     
     @classmethod
@@ -105,10 +125,72 @@ class DataAdapter:
         """
         return ["close", "high", "low", "volume", "symbol"]
     
+    @classmethod
+    def iter_bars(cls, df: pd.DataFrame) -> Iterator[NamedTuple]:
+        """
+        按行迭代适配后的 bar（namedtuple，字段为标准列名，datetime 在 Index 字段）
+        
+        一次性完成列名适配后用 itertuples 逐行产出，不为每根 bar 构造 Series / dict。
+        
+        Args:
+            df: 原始数据DataFrame
+            
+        Returns:
+            Iterator[NamedTuple]: 名为 Bar 的 namedtuple 迭代器，如 bar.close、bar.Index
+        """
+        adapted_df = cls.adapt_dataframe(df, cls.get_required_columns())
+        return adapted_df.itertuples(index=True, name="Bar")
+    
+    @classmethod
+    def to_bars(cls, adapted_df: pd.DataFrame) -> Bars:
+        """
+        把 adapt_dataframe 的结果一次性拆成 Bars（价格 / 成交量为 float64，已是 float64 的列不复制），
+        之后回测循环只访问连续数组，不再经过 DataFrame。
+        
+        Args:
+            adapted_df: 已适配为标准列名、且包含必需列的DataFrame
+            
+        Returns:
+            Bars: 按列存储的 bar 数组
+        """
+        index = adapted_df.index
+        if isinstance(index.dtype, np.dtype) and index.dtype.kind == "M":
+            ts = index.to_numpy()
+        else:
+            ts = np.array(index.to_list(), dtype=object)
+        return Bars(
+            datetime=ts,
+            close=adapted_df["close"].to_numpy(dtype=np.float64),
+            high=adapted_df["high"].to_numpy(dtype=np.float64),
+            low=adapted_df["low"].to_numpy(dtype=np.float64),
+            volume=adapted_df["volume"].to_numpy(dtype=np.float64),
+            symbol=adapted_df["symbol"].to_numpy(),
+        )
+    
+    @classmethod
+    def create_bar_dict_at(cls, adapted_df: pd.DataFrame, i: int,
+                           col_idx: Optional[Dict[str, int]] = None) -> Dict:
+        """
+        按位置从适配后的DataFrame取第 i 根 bar 的字典，用 iat 逐个取标量，不构造行 Series
+        
+        Args:
+            adapted_df: 已适配为标准列名的DataFrame
+            i: bar 的位置下标
+            col_idx: {标准列名: 列位置}，循环调用时预先算好传入；为 None 时取全部列
+            
+        Returns:
+            Dict: bar字典（含 datetime）
+        """
+        if col_idx is None:
+            col_idx = {name: j for j, name in enumerate(adapted_df.columns)}
+        bar_dict = {name: adapted_df.iat[i, j] for name, j in col_idx.items()}
+        bar_dict["datetime"] = adapted_df.index[i]
+        return bar_dict
+    
     @classmethod
     def create_bar_dict(cls, bar: pd.Series) -> Dict:
         """
-        创建标准的bar字典，适配数据库列名
+        创建标准的bar字典，适配数据库列名（保留为对外兼容接口，批量迭代请用 iter_bars / create_bar_dict_at）
         
         Args:
             bar: 原始数据Series
@@ -1,36 +1,163 @@
+import math
+from collections import deque
+from itertools import islice
 import numpy as np
+import pandas as pd
 from ..Strategy import Strategy
+from .._kernels import ma_cross_signals
 
 
 class MovingAverageStrategy(Strategy):
     """移动平均线策略"""
+
+    cash_fraction = 0.95  # 金叉时用于买入的资金比例
+    # 批量信号接口（on_bars / signal_bars）只代表本类 on_bar 的逻辑：子类改写了 on_bar 时默认不启用，
+    # 确认改写后的 on_bar 仍只在金叉/死叉 bar 上按同样规则下单的子类可设为 True 显式启用
+    vectorized = False
     
     def __init__(self, short_window: int = 5, long_window: int = 20):
         super().__init__()
         self.short_window = short_window
         self.long_window = long_window
-        self.prices = []
+        # 未经 prepare 时的逐 bar 计算：只保留最近一个窗口的价格
+        self.prices = deque(maxlen=max(short_window, long_window))
+        self._prepared = None  # prepare 算好的 (收盘价, 短均线, 长均线)，供 on_bars 复用
 
     def on_init(self):
         print("移动平均线策略初始化")
 
+    @staticmethod
+    def _exact_sum(values) -> float:
+        """价格之和，正确舍入（math.fsum：只在最后舍入一次，与求和顺序无关）；+inf 与 -inf 相消等无法求和时为 NaN"""
+        try:
+            return math.fsum(values)
+        except (ValueError, OverflowError):
+            return np.nan
+
+    @classmethod
+    def _window_sums(cls, close: np.ndarray, window: int) -> np.ndarray:
+        """
+        每个长度为 window 的窗口之和（共 N-window+1 个），与逐窗口 _exact_sum 逐位一致，O(N)、与窗口长度无关。
+        浮点数 = 整数尾数 × 2^指数：以全段最小指数为单位把价格换成精确的整数，窗口和由整数前缀和相减得到
+        （int64 回绕相减对不超出范围的结果仍精确），不存在滚动加减的舍入累积，最后只舍入一次。
+        结果超出 int64 时把整数拆成高低两段 32 位分别求和；价格跨度过大（指数相差约 2^30 倍以上）时逐窗口求和。
+        非有限值（NaN / inf）按 0 参与整数求和，含有它们的窗口再逐个重算。
+        """
+        n_windows = len(close) - window + 1
+        finite = np.isfinite(close)
+        mant, exp = np.frexp(np.where(finite, close, 0.0))
+        mant = (mant * 2.0 ** 53).astype(np.int64)  # 53 位整数尾数，值 = mant × 2^(exp-53)，精确
+        nonzero = mant != 0
+
+        def window_diff(a: np.ndarray) -> np.ndarray:
+            prefix = np.concatenate(([0], np.cumsum(a)))
+            return prefix[window:] - prefix[:-window]
+
+        sums = np.zeros(n_windows)
+        if nonzero.any():
+            exp = exp.astype(np.int64) - 53
+            e0 = int(exp[nonzero].min())
+            shift = np.where(nonzero, exp - e0, 0)
+            max_shift = int(shift.max())
+            if e0 < -1022 or int(exp.max()) > 900 or window * 2.0 ** (22 + max_shift) >= 2.0 ** 53:
+                return np.array([cls._exact_sum(close[i:i + window]) for i in range(n_windows)])
+            if max_shift + int(window).bit_length() <= 9:
+                # 窗口和不超过 2^62：单个 int64 即可，int64 → float64 的转换本身就是正确舍入
+                sums = np.ldexp(window_diff(mant << shift).astype(np.float64), e0)
+            else:
+                # 整数值 = hi × 2^32 + lo（0 <= lo < 2^32），两段分别求窗口和，再进位规整
+                low_bits = np.maximum(32 - shift, 0)
+                hi = np.where(shift >= 32, mant << np.maximum(shift - 32, 0), mant >> low_bits)
+                lo = np.where(shift >= 32, 0,
+                              (mant & ((np.int64(1) << low_bits) - 1)) << np.minimum(shift, 32))
+                sum_lo = window_diff(lo)
+                sum_hi = window_diff(hi) + (sum_lo >> 32)
+                sum_lo &= 0xFFFFFFFF
+                # sum_hi 不超过 2^53，乘 2^32 仍精确，与 sum_lo 相加时只舍入一次
+                sums = np.ldexp(np.ldexp(sum_hi.astype(np.float64), 32) + sum_lo.astype(np.float64), e0)
+
+        if not finite.all():
+            for i in np.flatnonzero(window_diff(~finite)):
+                sums[i] = cls._exact_sum(close[i:i + window])
+        return sums
+
+    @classmethod
+    def _rolling_mean(cls, close: np.ndarray, window: int) -> np.ndarray:
+        """
+        窗口均值（窗口和 / window，窗口和正确舍入），前 window-1 个为 NaN；与逐 bar 的 _update_rolling 逐位一致。
+        窗口和由 _window_sums 在 O(N) 内精确求出：不用浮点滚动和 / cumsum 差分，
+        它们的舍入误差随 bar 累积，价格持平时短/长均线出现 ulp 级差异，凭空产生交叉信号。
+        """
+        out = np.full(len(close), np.nan)
+        if 0 < window <= len(close):
+            out[window - 1:] = cls._window_sums(close, window) / window
+        return out
+
+    @classmethod
+    def precompute(cls, close: np.ndarray, short_window: int, long_window: int):
+        """
+        整段收盘价上一次算好 (短均线, 长均线)，回测循环按 bar 下标取值（算法见 _rolling_mean）。
+        """
+        close = np.asarray(close, dtype=np.float64)
+        return cls._rolling_mean(close, short_window), cls._rolling_mean(close, long_window)
+
+    def prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        """整段数据上一次性算好短/长均线，on_bar 里只做比较"""
+        if "close" not in df.columns:
+            return df
+        close = df["close"].to_numpy(dtype=np.float64)
+        ma_short, ma_long = self.precompute(close, self.short_window, self.long_window)
+        self._prepared = (close, ma_short, ma_long)
+        return df.assign(ma_short=ma_short, ma_long=ma_long)
+
+    def signal_bars(self, df: pd.DataFrame):
+        """金叉/死叉所在的 bar：其余 bar 上本类的 on_bar 不会下单（子类改写了 on_bar 时不适用）"""
+        if (not self._use_vectorized() or "ma_long" not in df.columns
+                or df["symbol"].nunique() > 1):
+            return None
+        signals = np.zeros(len(df), dtype=np.int8)
+        ma_cross_signals(df["ma_short"].to_numpy(dtype=np.float64),
+                         df["ma_long"].to_numpy(dtype=np.float64), signals)
+        return np.flatnonzero(signals)
+
+    def _use_vectorized(self) -> bool:
+        """on_bar 未被子类改写（或子类显式设置 vectorized = True）时才可用批量 / 信号 bar 路径"""
+        return self.vectorized or type(self).on_bar is MovingAverageStrategy.on_bar
+
+    def on_bars(self, close: np.ndarray, dt: np.ndarray, symbols: np.ndarray):
+        """批量接口：整段收盘价上算出金叉（买入 cash_fraction）/ 死叉（全部卖出）信号"""
+        if not self._use_vectorized() or len(pd.unique(symbols)) > 1:
+            return None
+        prepared = self._prepared
+        if prepared is not None and np.array_equal(prepared[0], close):
+            # 引擎已先调用 prepare：直接复用算好的均线
+            ma_short, ma_long = prepared[1], prepared[2]
+        else:
+            ma_short, ma_long = self.precompute(close, self.short_window, self.long_window)
+        cross = np.zeros(len(close), dtype=np.int8)
+        ma_cross_signals(ma_short, ma_long, cross)
+        return np.where(cross > 0, self.cash_fraction, cross.astype(np.float64))
+
     def on_bar(self, bar: dict):
         price = bar["close"]  # 使用标准列名
         symbol = bar.get("symbol", "000001.SZ")  # 默认使用第一个股票
         
-        self.prices.append(price)
-        
-        if len(self.prices) < self.long_window:
-            return
-        
-        short_ma = np.mean(self.prices[-self.short_window:])
-        long_ma = np.mean(self.prices[-self.long_window:])
+        if "ma_long" in bar:
+            # 均线已在 prepare 中预先计算
+            short_ma = bar["ma_short"]
+            long_ma = bar["ma_long"]
+            if np.isnan(long_ma):
+                return
+        else:
+            short_ma, long_ma = self._update_rolling(price)
+            if long_ma is None:
+                return
         pos = self.get_position(symbol)
         
         # 金叉买入，死叉卖出
         if short_ma > long_ma and pos["quantity"] == 0:
             # 买入
-            qty = self.broker.cash * 0.95 / price  # 使用95%资金
+            qty = self.broker.cash * self.cash_fraction / price  # 使用95%资金
             if qty > 0:
                 self.buy(symbol, price, qty, "MARKET")
                 print(f"[{bar['datetime']}] 买入 {symbol} {qty:.2f} 股 @ {price:.2f}")
@@ -40,6 +167,21 @@ class MovingAverageStrategy(Strategy):
             self.sell(symbol, price, pos["quantity"], "MARKET")
             print(f"[{bar['datetime']}] 卖出 {symbol} {pos['quantity']:.2f} 股 @ {price:.2f}")
 
+    def _update_rolling(self, price: float):
+        """
+        加入新价格；长窗口未满时返回 (None, None)。
+        均值按窗口逐个精确求和（_exact_sum，不维护加减更新的滚动和，避免舍入误差随 bar 累积），
+        与 prepare 的 _rolling_mean 逐位一致。
+        """
+        prices = self.prices
+        prices.append(price)
+        n = len(prices)
+        if n < self.long_window:
+            return None, None
+        short = min(n, self.short_window)
+        return (self._exact_sum(islice(prices, n - short, n)) / short,
+                self._exact_sum(islice(prices, n - self.long_window, n)) / self.long_window)
+
     def on_trade(self, trade: dict):
         print(f"[成交] {trade['side']} {trade['symbol']} {trade['quantity']:.2f} @ {trade['price']:.2f}")
 
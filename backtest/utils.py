@@ -1,16 +1,89 @@
+import contextlib
+import io
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Union
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from datetime import datetime, date
 from database import QuantDatabase
 from .Strategy import Strategy
 from .Backtesting import Backtesting
+from .Broker import Broker
 from .Analysis import BacktestAnalysis
+from .data_adapter import DataAdapter
+from .strategies import MovingAverageStrategy
+from ._kernels import SIDE_BUY, ma_cross_backtest
+
+
+def _ma_cross_jit(strategy: MovingAverageStrategy, df: pd.DataFrame,
+                  initial_cash: float) -> Optional[BacktestAnalysis]:
+    """
+    MovingAverageStrategy 的编译内核回测（见 _kernels.ma_cross_backtest），结果与 Backtesting 一致。
+    多标的数据或出现买单无法当根成交（Backtesting 会转为逐 bar 运行）时返回 None，由调用方回退。
+    """
+    bars = DataAdapter.to_bars(DataAdapter.adapt_dataframe(df, DataAdapter.get_required_columns()))
+    if len(pd.unique(bars.symbol)) > 1:
+        return None
+
+    close = bars.close
+    n = len(close)
+    equity = np.empty(n, dtype=np.float64)
+    cash = np.empty(n, dtype=np.float64)
+    trade_bar = np.empty(n, dtype=np.int64)
+    trade_side = np.empty(n, dtype=np.int8)
+    trade_px = np.empty(n, dtype=np.float64)
+    trade_qty = np.empty(n, dtype=np.float64)
+    trade_fee = np.empty(n, dtype=np.float64)
+    broker = Broker(initial_cash=initial_cash)
+    ma_short, ma_long = strategy.precompute(close, strategy.short_window, strategy.long_window)
+    n_trades, stuck = ma_cross_backtest(
+        close, ma_short, ma_long,
+        float(initial_cash), float(strategy.cash_fraction), broker.fee_rate, broker.slippage,
+        equity, cash, trade_bar, trade_side, trade_px, trade_qty, trade_fee,
+    )
+    if stuck >= 0:
+        return None
+
+    ts = bars.datetime
+    to_timestamp = pd.Timestamp if ts.dtype.kind == "M" else (lambda t: t)
+
+    strategy.on_init()
+    trades = []
+    for k in range(n_trades):
+        i = int(trade_bar[k])
+        trade = {
+            "order_id": k,
+            "symbol": bars.symbol[i],
+            "side": "BUY" if trade_side[k] == SIDE_BUY else "SELL",
+            "price": float(trade_px[k]),
+            "quantity": float(trade_qty[k]),
+            "fee": float(trade_fee[k]),
+            "timestamp": to_timestamp(ts[i])
+        }
+        trades.append(trade)
+        strategy.on_trade(trade)
+    strategy.on_finish()
+
+    results_df = pd.DataFrame({
+        "timestamp": ts,
+        "equity": equity,
+        "cash": cash,
+        "close": close
+    })
+    return BacktestAnalysis(results_df, trades, initial_cash)
+
+
+# 注册了编译内核的策略类（精确匹配：子类可能改写了 on_bar，走通用引擎）
+_JIT_BACKTESTS: Dict[type, Callable[..., Optional[BacktestAnalysis]]] = {
+    MovingAverageStrategy: _ma_cross_jit,
+}
 
 
 def run_backtest(symbol: str, start_date: Union[str, date, datetime], 
                  end_date: Union[str, date, datetime], 
                  strategy_class: type = None, 
-                 initial_cash: float = 100000, **strategy_kwargs):
+                 initial_cash: float = 100000, db: Optional[QuantDatabase] = None,
+                 **strategy_kwargs):
     """
     运行回测
     
@@ -20,38 +93,31 @@ def run_backtest(symbol: str, start_date: Union[str, date, datetime],
         end_date: 结束日期
         strategy_class: 策略类
         initial_cash: 初始资金
+        db: 已打开的数据库连接（由调用方负责关闭）；为 None 时使用进程内共享连接
         **strategy_kwargs: 策略参数
     
     Returns:
         BacktestAnalysis: 回测分析结果
     """
     if strategy_class is None:
-        from .strategies import MovingAverageStrategy
         strategy_class = MovingAverageStrategy
     
     # 加载数据，选择重要的价格和成交量指标
-    db = QuantDatabase(read_only=True)
+    own_db = db is None
+    if own_db:
+        db = QuantDatabase(read_only=True, shared=True)
     df = db.load_quotes(symbol, start_date, end_date)
+    if own_db:
+        db.close()
     
     if df.empty:
         print(f"没有找到 {symbol} 在 {start_date} 到 {end_date} 的数据")
-        db.close()
         return None
     
-    # 创建策略
-    strategy = strategy_class(**strategy_kwargs)
-    
-    # 运行回测
-    backtest = Backtesting(strategy, df, initial_cash=initial_cash)
-    backtest.run()
-    
-    # 分析结果
-    results_df = backtest.results()
-    analysis = BacktestAnalysis(results_df, backtest.broker.trades, initial_cash)
+    # 运行回测并分析结果
+    analysis = _backtest_one(strategy_class, df, initial_cash, strategy_kwargs)
     analysis.print_summary()
     
-    db.close()
-    
     return analysis
 
 
@@ -68,22 +134,49 @@ def load_multiple_symbols(symbols: List[str], start_date: Union[str, date, datet
     Returns:
         Dict[str, pd.DataFrame]: 股票数据字典
     """
-    db = QuantDatabase(read_only=True)
-    data_dict = {}
+    db = QuantDatabase(read_only=True, shared=True)
+    # 一次查询取回全部股票，再按股票拆分
+    data_dict = db.load_quotes_batch(symbols, start_date, end_date)
     
     for symbol in symbols:
-        df = db.load_quotes(symbol, start_date, end_date)
-        if not df.empty:
-            data_dict[symbol] = df
-        else:
+        if symbol not in data_dict:
             print(f"警告: 没有找到 {symbol} 的数据")
     
     db.close()
     return data_dict
 
 
+def _backtest_one(strategy_class: type, df: pd.DataFrame, initial_cash: float,
+                  strategy_kwargs: Dict) -> BacktestAnalysis:
+    """
+    单只股票回测（模块级函数，可在子进程中执行）。
+    注册了编译内核的策略直接在 NumPy 数组上整段计算，否则（或内核无法处理时）走通用引擎。
+    """
+    strategy = strategy_class(**strategy_kwargs)
+    jit = _JIT_BACKTESTS.get(strategy_class)
+    analysis = jit(strategy, df, initial_cash) if jit is not None else None
+    if analysis is not None:
+        return analysis
+    
+    backtest = Backtesting(strategy, df, initial_cash=initial_cash)
+    backtest.run()
+    
+    results_df = backtest.results()
+    return BacktestAnalysis(results_df, backtest.broker.trades, initial_cash)
+
+
+def _backtest_one_captured(strategy_class: type, df: pd.DataFrame, initial_cash: float,
+                           strategy_kwargs: Dict) -> Tuple[str, BacktestAnalysis]:
+    """在子进程中运行 _backtest_one，并收下这只股票回测期间的输出，交给主进程与标题一起打印"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        analysis = _backtest_one(strategy_class, df, initial_cash, strategy_kwargs)
+    return output.getvalue(), analysis
+
+
 def create_portfolio_backtest(strategy_class: type, data_dict: Dict[str, pd.DataFrame], 
-                             initial_cash: float = 100000, **strategy_kwargs):
+                             initial_cash: float = 100000, max_workers: Optional[int] = 1,
+                             **strategy_kwargs):
     """
     创建投资组合回测
     
@@ -91,6 +184,8 @@ def create_portfolio_backtest(strategy_class: type, data_dict: Dict[str, pd.Data
         strategy_class: 策略类
         data_dict: 股票数据字典
         initial_cash: 初始资金
+        max_workers: 并行回测的进程数；1（默认）为在当前进程依次回测，None 为 CPU 核数。
+            多进程时 strategy_class 需可被 pickle（定义在可导入的模块里）
         **strategy_kwargs: 策略参数
     
     Returns:
@@ -98,14 +193,51 @@ def create_portfolio_backtest(strategy_class: type, data_dict: Dict[str, pd.Data
     """
     results = {}
     
-    for symbol, df in data_dict.items():
-        print(f"\n=== 回测 {symbol} ===")
-        strategy = strategy_class(**strategy_kwargs)
-        backtest = Backtesting(strategy, df, initial_cash=initial_cash)
-        backtest.run()
-        
-        results_df = backtest.results()
-        analysis = BacktestAnalysis(results_df, backtest.broker.trades, initial_cash)
-        results[symbol] = analysis
-    
-    return results
\ No newline at end of file
+    if max_workers == 1 or len(data_dict) <= 1:
+        for symbol, df in data_dict.items():
+            print(f"\n=== 回测 {symbol} ===")
+            results[symbol] = _backtest_one(strategy_class, df, initial_cash, strategy_kwargs)
+        return results
+    
+    # 各股票回测相互独立：分发到多个进程，结果按原顺序收集。
+    # 子进程的输出随结果一起带回，与该股票的标题一起打印，各股票的日志不会交错、也不会跑到标题前面
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            symbol: pool.submit(_backtest_one_captured, strategy_class, df, initial_cash,
+                                strategy_kwargs)
+            for symbol, df in data_dict.items()
+        }
+        for symbol, future in futures.items():
+            output, results[symbol] = future.result()
+            print(f"\n=== 回测 {symbol} ===")
+            print(output, end="")
+    
+    return results
+
+
+def run_backtests(symbols: List[str], start_date: Union[str, date, datetime],
+                  end_date: Union[str, date, datetime], strategy_class: type = None,
+                  initial_cash: float = 100000, max_workers: Optional[int] = None,
+                  **strategy_kwargs) -> Dict[str, BacktestAnalysis]:
+    """
+    对多只股票分别运行同一策略的回测（参数扫描 / 选股批量回测）
+    
+    Args:
+        symbols: 股票代码列表
+        start_date: 开始日期
+        end_date: 结束日期
+        strategy_class: 策略类
+        initial_cash: 每只股票的初始资金
+        max_workers: 并行回测的进程数；None（默认）为 CPU 核数，1 为在当前进程依次回测
+        **strategy_kwargs: 策略参数
+    
+    Returns:
+        Dict[str, BacktestAnalysis]: 各股票回测结果（没有数据的股票不出现在结果里）
+    """
+    if strategy_class is None:
+        strategy_class = MovingAverageStrategy
+    
+    # 一次查询取回全部股票，再按股票分发到各进程回测
+    data_dict = load_multiple_symbols(symbols, start_date, end_date)
+    return create_portfolio_backtest(strategy_class, data_dict, initial_cash=initial_cash,
+                                     max_workers=max_workers, **strategy_kwargs)
@@ -1,20 +1,34 @@
 import configparser
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
 
-def load_config() -> Tuple[Path, Path, bool, bool]:
+IMPORT_ENGINES = ("pandas", "duckdb")
+
+# load_config() 返回值依次对应的模块属性，首次访问时才读取配置文件（见 __getattr__）
+_CONFIG_NAMES = ("DATA_ROOT", "DB_PATH", "FULL_REBUILD", "INGEST_ON_START", "IMPORT_ENGINE",
+                 "PARQUET_ROOT", "IMPORT_PROCESSES")
+
+
+@lru_cache(maxsize=1)
+def load_config() -> Tuple[Path, Path, bool, bool, str, Optional[Path], bool]:
     """
     读取配置：
     [paths]
     data_root = ...
     db_path   = ...
+    parquet_root = ...   （可选，留空则不导出 Parquet）
 
     [import]
     full_rebuild = true/false
+    engine       = pandas/duckdb
+    processes    = true/false
 
     [main]
     ingest_on_start = true/false
+
+    只在第一次调用时读取文件（相对当前工作目录），之后返回缓存结果。
     """
     cfg = configparser.ConfigParser()
 
@@ -35,17 +49,41 @@ def load_config() -> Tuple[Path, Path, bool, bool]:
     data_root = Path(cfg["paths"]["data_root"])
     db_path = Path(cfg["paths"]["db_path"])
 
+    # 可选：按 trade_date / 标的分区的 Parquet 导出目录，查询时优先读取
+    parquet_root = None
+    if cfg.has_option("paths", "parquet_root") and cfg.get("paths", "parquet_root").strip():
+        parquet_root = Path(cfg.get("paths", "parquet_root").strip())
+
     # 导入模式：是否每次全量重建
     full_rebuild = True
     if cfg.has_section("import") and cfg.has_option("import", "full_rebuild"):
         full_rebuild = cfg.getboolean("import", "full_rebuild")
 
+    # 导入引擎：pandas=在 Python 里清洗；duckdb=原始数据交给 DuckDB 用 SQL 清洗
+    import_engine = "pandas"
+    if cfg.has_section("import") and cfg.has_option("import", "engine"):
+        import_engine = cfg.get("import", "engine").strip().lower()
+    if import_engine not in IMPORT_ENGINES:
+        raise RuntimeError(
+            f"[import] engine 只能是 {' / '.join(IMPORT_ENGINES)}，当前为 {import_engine!r}。"
+        )
+
+    # 是否用多进程解析/清洗 CSV（默认用线程池）
+    import_processes = False
+    if cfg.has_section("import") and cfg.has_option("import", "processes"):
+        import_processes = cfg.getboolean("import", "processes")
+
     # main 开关：启动时是否自动执行 ingest_all()
     ingest_on_start = False  # 默认不自动导入
     if cfg.has_section("main") and cfg.has_option("main", "ingest_on_start"):
         ingest_on_start = cfg.getboolean("main", "ingest_on_start")
 
-    return data_root, db_path, full_rebuild, ingest_on_start
+    return (data_root, db_path, full_rebuild, ingest_on_start, import_engine, parquet_root,
+            import_processes)
 
 
-DATA_ROOT, DB_PATH, FULL_REBUILD, INGEST_ON_START = load_config()
+def __getattr__(name: str):
+    """config.DATA_ROOT 等常量按需读取：只 import 本模块不会读取配置文件"""
+    if name in _CONFIG_NAMES:
+        return load_config()[_CONFIG_NAMES.index(name)]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,20 @@
+"""
+pytest 公共夹具
+"""
+
+import duckdb
+import pytest
+
+from database import QuantDatabase
+
+
+@pytest.fixture(scope="session")
+def db():
+    """整个测试会话共用一个只读数据库连接；没有数据库文件时为 None，测试改用模拟数据"""
+    try:
+        d = QuantDatabase(read_only=True)
+    except duckdb.IOException:
+        yield None
+        return
+    yield d
+    d.close()
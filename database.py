@@ -1,23 +1,107 @@
+from collections import OrderedDict
 from pathlib import Path
 from datetime import date, datetime
-from typing import Optional, Sequence, Union
+from typing import Dict, Optional, Sequence, Tuple, Union
 import duckdb
+import numpy as np
 import pandas as pd
-from config import DB_PATH
+import config
 
 DateLike = Union[str, date, datetime]
 
+_POW10 = 10 ** np.arange(19, dtype=np.int64)  # 1, 10, ..., 10**18，用于计算整数位数
+
+_COMPACT_FLOAT_COLS = ("成交价", "成交量")  # compact=True 时转成 float32 的列
+
+_SHARED_CONS: Dict[Tuple[str, bool], duckdb.DuckDBPyConnection] = {}  # (库文件, 只读) → 进程内共享连接
+
+
+def shared_connection(db_path: Optional[Union[str, Path]] = None,
+                      read_only: bool = True) -> duckdb.DuckDBPyConnection:
+    """
+    返回进程内共享的 DuckDB 连接（首次调用时打开）。
+    多次回测复用同一个数据库实例：省去反复打开库文件的开销，缓冲池里已读过的数据块也得以保留。
+    注意 DuckDB 不允许同一进程对同一库文件同时持有只读和读写两种连接，
+    需要写库（如 ingest_all）前先调用 close_shared_connections()。
+    """
+    key = (str(Path(db_path if db_path is not None else config.DB_PATH).resolve()), read_only)
+    con = _SHARED_CONS.get(key)
+    if con is None:
+        con = duckdb.connect(key[0], read_only=read_only)
+        con.execute("SET enable_object_cache = true")  # 缓存 Parquet 元数据，重复查询不再解析文件尾
+        _SHARED_CONS[key] = con
+    return con
+
+
+def close_shared_connections():
+    """关闭 shared_connection 打开的所有连接"""
+    while _SHARED_CONS:
+        _, con = _SHARED_CONS.popitem()
+        con.close()
+
+
+# load_quotes 的进程内结果缓存：键 → DataFrame，按最近使用顺序淘汰
+_QUOTES_CACHE: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
+_QUOTES_CACHE_SIZE = 128
+
+
+def clear_quotes_cache():
+    """清空 load_quotes 的结果缓存"""
+    _QUOTES_CACHE.clear()
+
+
+_PANDAS_MAJOR = int(pd.__version__.split(".")[0])
+
+
+def _copy_on_write() -> bool:
+    """pandas >= 3 始终写时复制；pandas 2.x 只有显式开启 mode.copy_on_write 时才是"""
+    return _PANDAS_MAJOR >= 3 or pd.options.mode.copy_on_write is True
+
 
 class QuantDatabase:
     """
     封装对 DuckDB 的读取操作，给回测/策略使用。
     """
 
-    def __init__(self, db_path: Optional[Union[str, Path]] = None, read_only: bool = True):
+    def __init__(self, db_path: Optional[Union[str, Path]] = None, read_only: bool = True,
+                 parquet_root: Optional[Union[str, Path]] = None, shared: bool = False):
+        """
+        shared=True 时在进程内共享连接（见 shared_connection）上开一个游标，
+        close() 只关闭游标，数据库实例与其缓存继续留给之后的查询。
+        """
         if db_path is None:
-            db_path = DB_PATH
+            db_path = config.DB_PATH
+        if parquet_root is None:
+            parquet_root = config.PARQUET_ROOT
         self.db_path = Path(db_path)
-        self.con = duckdb.connect(str(self.db_path), read_only=read_only)
+        self.parquet_root = Path(parquet_root) if parquet_root is not None else None
+        self.read_only = read_only
+        if shared:
+            self.con = shared_connection(self.db_path, read_only).cursor()
+        else:
+            self.con = duckdb.connect(str(self.db_path), read_only=read_only)
+        self._register_parquet_views()
+
+    def _register_parquet_views(self):
+        """
+        存在 Parquet 分区导出（见 ingest.export_parquet）时，为每张表建同名临时视图读取分区文件，
+        覆盖库里的同名表；trade_date / 万得代码 上的过滤会裁剪到对应分区，只读取用到的列。
+        万得代码 放在第一列、分区键 trade_date 在最后，列顺序与库里的表一致。
+        分区键显式声明类型（trade_date 为 DATE、symbol 为 VARCHAR），不依赖按路径取值的自动类型推断，
+        查询里的 DATE 参数直接与分区值比较并据此裁剪分区。
+        """
+        if self.parquet_root is None:
+            return
+        for table_name in ("quotes", "tick_trades", "tick_orders"):
+            if not (self.parquet_root / table_name).is_dir():
+                continue
+            pattern = str(self.parquet_root / table_name / "**" / "*.parquet").replace("'", "''")
+            self.con.execute(
+                f"CREATE OR REPLACE TEMP VIEW {table_name} AS "
+                f"SELECT symbol AS 万得代码, * EXCLUDE (symbol) "
+                f"FROM read_parquet('{pattern}', hive_partitioning = true, "
+                f"hive_types = {{'trade_date': DATE, 'symbol': VARCHAR}})"
+            )
 
     # ---- 小工具 ----
 
@@ -32,6 +116,97 @@ class QuantDatabase:
     def close(self):
         self.con.close()
 
+    @staticmethod
+    def _time_digits(time_col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        把 时间 列整理成 (数字值, 数字位数) 两个 int64 数组，规则同“去掉 .0、只保留数字后的字符串”：
+        整数 / 整值浮点直接按数值计算位数；字符串、负数、非整值等才走字符串清洗。
+        超过 9 位的值只有前 6 位（HHMMSS）和后 3 位（毫秒）有意义，统一折算成 9 位。
+        """
+        n_rows = len(time_col)
+        values = np.zeros(n_rows, dtype=np.int64)
+        n_digits = np.zeros(n_rows, dtype=np.int64)
+        fallback = np.ones(n_rows, dtype=bool)
+
+        is_number = pd.api.types.is_numeric_dtype(time_col) and not pd.api.types.is_bool_dtype(time_col)
+        if is_number:
+            missing = time_col.isna().to_numpy()
+            if pd.api.types.is_integer_dtype(time_col):
+                v = time_col.fillna(0).to_numpy(dtype=np.int64)
+                ok = ~missing & (v >= 0)
+            else:
+                f = time_col.to_numpy(dtype=np.float64, na_value=np.nan)
+                with np.errstate(invalid="ignore"):
+                    ok = np.isfinite(f) & (f >= 0) & (f < 1e15) & (f == np.floor(f))
+                v = np.where(ok, f, 0).astype(np.int64)
+            values[ok] = v[ok]
+            n_digits[ok] = np.maximum(np.searchsorted(_POW10, v[ok], side="right"), 1)
+            fallback = ~ok & ~missing  # 缺失值转成字符串后没有数字，位数为 0
+
+        if fallback.any():
+            values[fallback], n_digits[fallback] = QuantDatabase._string_time_digits(time_col[fallback])
+
+        long = n_digits > 9
+        if long.any():
+            v = values[long]
+            values[long] = v // _POW10[n_digits[long] - 6] * 1000 + v % 1000
+            n_digits[long] = 9
+        return values, n_digits
+
+    @staticmethod
+    def _string_time_digits(time_col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        _time_digits 的字符串清洗部分：去空白、去 .0、只保留数字后返回 (数值, 位数)；
+        超过 18 位（int64 放不下）的只取前 6 位和后 3 位，按 9 位处理。
+        优先用 pyarrow.compute 的字符串内核（C++ 实现，不逐元素回到 Python），未安装 pyarrow 时用 pandas 字符串方法。
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError:
+            return QuantDatabase._string_time_digits_pandas(time_col)
+
+        digits = pa.array(time_col.astype(str), type=pa.string(), from_pandas=True)
+        digits = pc.utf8_trim_whitespace(digits)
+        digits = pc.replace_substring_regex(digits, r"\.0$", "")  # 去掉可能的 .0
+        digits = pc.replace_substring_regex(digits, r"\D", "")    # 只保留数字
+        digits = pc.fill_null(digits, "")
+
+        n = pc.utf8_length(digits).to_numpy().astype(np.int64)
+        huge = n > 18
+        small = pc.if_else(pa.array(~huge), digits, "")
+        v = pc.cast(pc.if_else(pc.equal(small, ""), "0", small), pa.int64()).to_numpy().copy()
+        if huge.any():
+            big = pc.filter(digits, pa.array(huge))
+            head = pc.cast(pc.utf8_slice_codeunits(big, 0, 6), pa.int64()).to_numpy()
+            tail = pc.cast(pc.utf8_slice_codeunits(big, -3), pa.int64()).to_numpy()
+            v[huge] = head * 1000 + tail
+            n[huge] = 9
+        return v, n
+
+    @staticmethod
+    def _string_time_digits_pandas(time_col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """_string_time_digits 的 pandas 实现"""
+        digits = (
+            time_col
+            .astype(str)
+            .str.strip()
+            .str.replace(r"\.0$", "", regex=True)  # 去掉可能的 .0
+            .str.replace(r"\D", "", regex=True)    # 只保留数字
+            .fillna("")
+        )
+        n = digits.str.len().to_numpy(dtype=np.int64).copy()
+        huge = n > 18
+        v = np.zeros(len(digits), dtype=np.int64)
+        if (~huge).any():
+            v[~huge] = pd.to_numeric(digits[~huge].replace("", "0")).to_numpy(dtype=np.int64)
+        if huge.any():
+            head = pd.to_numeric(digits[huge].str.slice(0, 6)).to_numpy(dtype=np.int64)
+            tail = pd.to_numeric(digits[huge].str.slice(-3)).to_numpy(dtype=np.int64)
+            v[huge] = head * 1000 + tail
+            n[huge] = 9
+        return v, n
+
     @staticmethod
     def _attach_datetime_index(df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -42,91 +217,112 @@ class QuantDatabase:
         - 时间:
             * 6 位: HHMMSS              -> 毫秒=000
             * 7~9 位: HHMMSSmmm 变体   -> 取最后 3 位为毫秒
-        其他格式一律视为非法，整行丢弃。
+        其他格式一律视为非法，整行丢弃。时分秒由整数除法/取模得到，不做逐行字符串拼接。
         """
         if "trade_date" not in df.columns or "时间" not in df.columns or df.empty:
             return df
 
-        # 日期部分：直接用 trade_date
-        date_str = pd.to_datetime(df["trade_date"]).dt.strftime("%Y%m%d")
-
-        # 时间原始字符串
-        time_raw = (
-            df["时间"]
-            .astype(str)
-            .str.strip()
-            .str.replace(r"\.0$", "", regex=True)  # 去掉可能的 .0
-        )
-
-        # 只保留数字
-        time_digits = time_raw.str.replace(r"\D", "", regex=True)
-        len_digits = time_digits.str.len()
+        t, n_digits = QuantDatabase._time_digits(df["时间"])
 
         # 合法长度：6 或 >6
-        mask_valid = (len_digits == 6) | (len_digits > 6)
-        bad = (~mask_valid).sum()
+        mask_valid = n_digits >= 6
+        bad = int((~mask_valid).sum())
         if bad:
             print(f"[QuantDatabase] 有 {bad} 条时间格式异常记录被丢弃（长度不是 6 或 >6）。")
-
-        df = df[mask_valid].copy()
+            df = df.take(np.flatnonzero(mask_valid))
+            t = t[mask_valid]
+            n_digits = n_digits[mask_valid]
         if df.empty:
             return df
 
-        date_str = date_str[mask_valid]
-        time_digits = time_digits[mask_valid]
-        len_digits = len_digits[mask_valid]
-
-        # 无毫秒：HHMMSS
-        mask_no_ms = (len_digits == 6)
-        mask_with_ms = ~mask_no_ms
-
-        h = pd.Series(index=time_digits.index, dtype="string")
-        m = pd.Series(index=time_digits.index, dtype="string")
-        s = pd.Series(index=time_digits.index, dtype="string")
-        ms = pd.Series("000", index=time_digits.index, dtype="string")
-
-        # 1) 无毫秒
-        if mask_no_ms.any():
-            t6 = time_digits[mask_no_ms].str.zfill(6)
-            h[mask_no_ms] = t6.str.slice(0, 2)
-            m[mask_no_ms] = t6.str.slice(2, 4)
-            s[mask_no_ms] = t6.str.slice(4, 6)
-
-        # 2) 有毫秒：取最后 3 位为毫秒，前面作为 HHMMSS
-        if mask_with_ms.any():
-            td = time_digits[mask_with_ms]
-            ms_part = td.str.slice(-3)
-            hms_part = td.str.slice(0, -3).str.zfill(6)
-
-            h[mask_with_ms] = hms_part.str.slice(0, 2)
-            m[mask_with_ms] = hms_part.str.slice(2, 4)
-            s[mask_with_ms] = hms_part.str.slice(4, 6)
-            ms[mask_with_ms] = ms_part
-
-        # 毫秒 -> 微秒（3 位 + 3 个 0）
-        micro_str = ms + "000"
-
-        dt_str = (
-            date_str.astype(str)
-            + h.astype(str)
-            + m.astype(str)
-            + s.astype(str)
-            + micro_str.astype(str)
-        )
+        # 6 位无毫秒；7~9 位最后 3 位为毫秒，前面是（左补 0 的）HHMMSS
+        no_ms = n_digits == 6
+        hms = np.where(no_ms, t, t // 1000)
+        ms = np.where(no_ms, 0, t % 1000)
+        h = hms // 10000
+        m = hms // 100 % 100
+        s = hms % 100
 
-        # 最终应为 8+2+2+2+6 = 20 位数字
-        mask_dt = dt_str.str.match(r"^\d{20}$")
-        bad2 = (~mask_dt).sum()
+        mask_dt = (h < 24) & (m < 60) & (s < 60)
+        bad2 = int((~mask_dt).sum())
         if bad2:
             print(f"[QuantDatabase] 有 {bad2} 条日期时间组合异常被丢弃。")
-            df = df[mask_dt].copy()
-            dt_str = dt_str[mask_dt]
-
+            df = df.take(np.flatnonzero(mask_dt))
+            h, m, s, ms = h[mask_dt], m[mask_dt], s[mask_dt], ms[mask_dt]
         if df.empty:
             return df
 
-        df["datetime"] = pd.to_datetime(dt_str, format="%Y%m%d%H%M%S%f")
-        df = df.set_index("datetime").sort_index()
+        day = pd.to_datetime(df["trade_date"]).to_numpy().astype("datetime64[D]").astype("datetime64[us]")
+        micros = ((h * 60 + m) * 60 + s) * 1_000_000 + ms * 1000
+        df["datetime"] = day + micros.astype("timedelta64[us]")
+        df = df.set_index("datetime").sort_index(kind="stable")
+        return df
+
+    @staticmethod
+    def _datetime_sql(source_sql: str) -> str:
+        """
+        在 SQL 里按 _attach_datetime_index 的同一约定由 trade_date + 时间 生成 datetime 列：
+        - 时间 去掉 .0 和非数字后，6 位为 HHMMSS，>6 位取最后 3 位为毫秒，其余左补 0 截成 HHMMSS
+        - _time_ok: 时间长度合法；datetime: 组合后的时间戳（时分秒越界时为 NULL）
+        source_sql 为带 WHERE 的子查询，外层可直接选取其中所有列。
+        """
+        return rf"""
+        SELECT * EXCLUDE (_t, _hms, _ms, _h, _m, _s),
+               CASE WHEN _time_ok AND _h < 24 AND _m < 60 AND _s < 60
+                    THEN CAST(trade_date AS TIMESTAMP)
+                         + to_microseconds(((_h * 60 + _m) * 60 + _s) * 1000000 + _ms * 1000)
+               END AS datetime
+        FROM (
+            SELECT *,
+                   length(_t) >= 6 AS _time_ok,
+                   CAST(substr(_hms, 1, 2) AS BIGINT) AS _h,
+                   CAST(substr(_hms, 3, 2) AS BIGINT) AS _m,
+                   CAST(substr(_hms, 5, 2) AS BIGINT) AS _s
+            FROM (
+                SELECT *,
+                       CASE WHEN length(_t) = 6 THEN _t
+                            ELSE lpad(left(_t, length(_t) - 3), 6, '0') END AS _hms,
+                       CASE WHEN length(_t) > 6 THEN CAST(right(_t, 3) AS BIGINT)
+                            ELSE 0 END AS _ms
+                FROM (
+                    SELECT *,
+                           regexp_replace(
+                               regexp_replace(trim(CAST(时间 AS VARCHAR)), '\.0$', ''),
+                               '\D', '', 'g'
+                           ) AS _t
+                    FROM ({source_sql})
+                )
+            )
+        )
+        """
+
+    @staticmethod
+    def _set_sql_datetime_index(df: pd.DataFrame, sort: bool = True) -> pd.DataFrame:
+        """把 _datetime_sql 算好的 datetime 设为索引，丢弃非法行（提示信息与 _attach_datetime_index 一致）"""
+        time_ok = df.pop("_time_ok").fillna(False).to_numpy(dtype=bool)
+        valid = df["datetime"].notna().to_numpy()
+        bad = int((~time_ok).sum())
+        if bad:
+            print(f"[QuantDatabase] 有 {bad} 条时间格式异常记录被丢弃（长度不是 6 或 >6）。")
+        bad2 = int((time_ok & ~valid).sum())
+        if bad2:
+            print(f"[QuantDatabase] 有 {bad2} 条日期时间组合异常被丢弃。")
+        if not valid.all():
+            df = df.take(np.flatnonzero(valid))
+        df = df.set_index("datetime")
+        return df.sort_index(kind="stable") if sort else df
+
+    @staticmethod
+    def _compact_quotes(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        压缩行情列宽：成交价 / 成交量 转 float32，万得代码 转 category（每行只存一个整数编码）。
+        float32 约 7 位有效数字，回测价格够用，但与 float64 的计算结果会有微小差异，因此只在显式要求时使用。
+        """
+        for c in _COMPACT_FLOAT_COLS:
+            if c in df.columns:
+                df[c] = df[c].astype(np.float32)
+        if "万得代码" in df.columns:
+            df["万得代码"] = df["万得代码"].astype("category")
         return df
 
     # ---- 常用查询接口 ----
@@ -145,26 +341,235 @@ class QuantDatabase:
         start_date: DateLike,
         end_date: DateLike,
         columns: Optional[Sequence[str]] = None,
+        compact: bool = False,
+        cache: bool = True,
     ) -> pd.DataFrame:
         """
         读取区间内某只股票的分笔行情（quotes 表）。
+        compact=True 时压缩列宽以减少内存占用与带宽（见 _compact_quotes）。
+        cache=True（默认，仅只读连接）时相同参数的重复查询直接取进程内缓存（_QUOTES_CACHE，最多 128 项）：
+        查询始终经由本实例的连接执行，缓存只记录键与结果；键包含库文件与所读 Parquet 分区文件的修改时间，
+        重新导入 / 导出数据后旧结果自然失效。
+        写时复制（pandas >= 3）下返回缓存结果的浅拷贝，调用方的修改不会影响缓存；
+        没有写时复制时（pandas 2.x 默认）原地修改会写进共享的列数组，因此返回深拷贝。
+        """
+        start_d = self._to_date(start_date)
+        end_d = self._to_date(end_date)
+        columns = tuple(columns) if columns is not None else None
+
+        if not (cache and self.read_only):
+            return self._query_quotes(symbol, start_d, end_d, columns, compact)
+
+        key = (str(self.db_path.resolve()), self.db_path.stat().st_mtime_ns,
+               self._parquet_state("quotes", symbol, start_d, end_d),
+               symbol, start_d, end_d, columns, compact)
+        df = _QUOTES_CACHE.get(key)
+        if df is None:
+            df = self._query_quotes(symbol, start_d, end_d, columns, compact)
+            _QUOTES_CACHE[key] = df
+            if len(_QUOTES_CACHE) > _QUOTES_CACHE_SIZE:
+                _QUOTES_CACHE.popitem(last=False)
+        else:
+            _QUOTES_CACHE.move_to_end(key)
+        return df.copy(deep=not _copy_on_write())
+
+    def _parquet_state(self, table_name: str, symbol: str, start_d: date,
+                       end_d: date) -> Optional[Tuple[str, int, int]]:
+        """
+        查询会读到的 Parquet 分区文件的状态：(导出目录, 文件数, 最大修改时间)。
+        导出是按分区覆盖写文件、目录本身的修改时间不变，因此逐个查看区间内该股票的分区文件。
+        没有 Parquet 导出时返回 None。
+        """
+        if self.parquet_root is None:
+            return None
+        table_dir = self.parquet_root / table_name
+        if not table_dir.is_dir():
+            return None
+        count = 0
+        latest = 0
+        for day_dir in table_dir.glob("trade_date=*"):
+            try:
+                d = date.fromisoformat(day_dir.name.split("=", 1)[1])
+            except ValueError:
+                continue
+            if not start_d <= d <= end_d:
+                continue
+            for f in (day_dir / f"symbol={symbol}").glob("*.parquet"):
+                count += 1
+                latest = max(latest, f.stat().st_mtime_ns)
+        return str(table_dir.resolve()), count, latest
+
+    def _query_quotes(self, symbol: str, start_d: date, end_d: date,
+                      columns: Optional[Tuple[str, ...]], compact: bool) -> pd.DataFrame:
+        """load_quotes 的实际查询（不经缓存）"""
+        cols_expr = "*" if columns is None else ", ".join([*columns, "_time_ok", "datetime"])
+
+        # datetime 在 DuckDB 里向量化生成，pandas 侧只做设索引
+        source = f"""
+            SELECT * FROM quotes
+            WHERE 万得代码 = ?
+              AND trade_date BETWEEN ? AND ?
+        """
+        sql = f"""
+        SELECT {cols_expr}
+        FROM ({self._datetime_sql(source)})
+        """
+
+        df = self.con.execute(sql, [symbol, start_d, end_d]).df()
+        if df.empty:
+            return df.drop(columns=["_time_ok", "datetime"])
+        df = self._set_sql_datetime_index(df)
+        return self._compact_quotes(df) if compact else df
+
+    def load_quotes_arrow(
+        self,
+        symbol: str,
+        start_date: DateLike,
+        end_date: DateLike,
+        columns: Optional[Sequence[str]] = None,
+    ) -> "pyarrow.Table":
+        """
+        与 load_quotes 相同的查询，但直接返回 DuckDB 的 Arrow 结果（pyarrow.Table），不转换成 pandas。
+        datetime 为普通列（已按时间排序），时间非法的行已剔除；适合后续仍在 Arrow / NumPy 里处理的场景。
         """
         start_d = self._to_date(start_date)
         end_d = self._to_date(end_date)
 
-        cols_expr = "*" if columns is None else ", ".join(columns)
+        cols_expr = "* EXCLUDE (_time_ok)" if columns is None else ", ".join([*columns, "datetime"])
 
+        source = f"""
+            SELECT * FROM quotes
+            WHERE 万得代码 = ?
+              AND trade_date BETWEEN ? AND ?
+        """
         sql = f"""
         SELECT {cols_expr}
-        FROM quotes
-        WHERE 万得代码 = ?
-          AND trade_date BETWEEN ? AND ?
-        ORDER BY trade_date, 时间
+        FROM ({self._datetime_sql(source)})
+        WHERE datetime IS NOT NULL
+        ORDER BY datetime
+        """
+        return self.con.execute(sql, [symbol, start_d, end_d]).to_arrow_table()
+
+    def load_quotes_batch(
+        self,
+        symbols: Sequence[str],
+        start_date: DateLike,
+        end_date: DateLike,
+        columns: Optional[Sequence[str]] = None,
+        compact: bool = False,
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        一次查询读取多只股票的分笔行情，按股票拆分为 {symbol: DataFrame}。
+        每个 DataFrame 与 load_quotes(symbol, ..., compact) 的结果一致；没有数据的股票不出现在结果里。
+        """
+        start_d = self._to_date(start_date)
+        end_d = self._to_date(end_date)
+
+        if columns is None:
+            cols_expr = "*"
+        else:
+            cols_expr = ", ".join(dict.fromkeys([*columns, "万得代码", "_time_ok", "datetime"]))
+
+        source = f"""
+            SELECT * FROM quotes
+            WHERE 万得代码 = ANY(?)
+              AND trade_date BETWEEN ? AND ?
+        """
+        sql = f"""
+        SELECT {cols_expr}
+        FROM ({self._datetime_sql(source)})
+        """
+
+        df = self.con.execute(sql, [list(symbols), start_d, end_d]).df()
+        if df.empty:
+            return {}
+        df = self._set_sql_datetime_index(df, sort=False)
+        if compact:
+            df = self._compact_quotes(df)
+
+        # 按股票取行位置拆分，每组内再按时间排序，与单只读取一致
+        groups = df.groupby("万得代码", sort=False).indices
+        drop = [] if columns is None or "万得代码" in columns else ["万得代码"]
+        return {
+            symbol: df.take(groups[symbol]).drop(columns=drop).sort_index(kind="stable")
+            for symbol in symbols if symbol in groups
+        }
+
+    def load_bars(
+        self,
+        symbol: str,
+        start_date: DateLike,
+        end_date: DateLike,
+        freq: str = "1 minute",
+    ) -> pd.DataFrame:
+        """
+        在 DuckDB 里把分笔行情聚合成 K 线（freq 为 DuckDB INTERVAL 字符串，如 "1 minute" / "5 minutes"）。
+        列名沿用 quotes 表的中文列名（开盘价/最高价/最低价/成交价/成交量/成交额），可直接交给回测。
+        """
+        start_d = self._to_date(start_date)
+        end_d = self._to_date(end_date)
+
+        source = f"""
+            SELECT 万得代码, trade_date, 时间, 成交价, 成交量, 成交额
+            FROM quotes
+            WHERE 万得代码 = ?
+              AND trade_date BETWEEN ? AND ?
+        """
+        sql = f"""
+        SELECT time_bucket(CAST(? AS INTERVAL), datetime) AS datetime,
+               any_value(万得代码)              AS 万得代码,
+               first(成交价 ORDER BY datetime)  AS 开盘价,
+               max(成交价)                      AS 最高价,
+               min(成交价)                      AS 最低价,
+               last(成交价 ORDER BY datetime)   AS 成交价,
+               sum(成交量)                      AS 成交量,
+               sum(成交额)                      AS 成交额
+        FROM ({self._datetime_sql(source)})
+        WHERE datetime IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        """
+
+        df = self.con.execute(sql, [freq, symbol, start_d, end_d]).df()
+        return df.set_index("datetime")
+
+    def load_close_with_ma(
+        self,
+        symbol: str,
+        start_date: DateLike,
+        end_date: DateLike,
+        short_window: int,
+        long_window: int,
+    ) -> pd.DataFrame:
+        """
+        读取成交价，并在 DuckDB 里用窗口函数算好短/长均线（ma_short / ma_long）。
+        不足一个窗口的 bar 均线为 NaN，与 MovingAverageStrategy 的预热期一致。
+        """
+        start_d = self._to_date(start_date)
+        end_d = self._to_date(end_date)
+
+        source = f"""
+            SELECT 万得代码, trade_date, 时间, 成交价, 成交量
+            FROM quotes
+            WHERE 万得代码 = ?
+              AND trade_date BETWEEN ? AND ?
+        """
+        sql = f"""
+        SELECT datetime, 万得代码, 成交价, 成交量,
+               CASE WHEN row_number() OVER w >= {int(short_window)}
+                    THEN avg(成交价) OVER (w ROWS BETWEEN {int(short_window) - 1} PRECEDING AND CURRENT ROW)
+               END AS ma_short,
+               CASE WHEN row_number() OVER w >= {int(long_window)}
+                    THEN avg(成交价) OVER (w ROWS BETWEEN {int(long_window) - 1} PRECEDING AND CURRENT ROW)
+               END AS ma_long
+        FROM ({self._datetime_sql(source)})
+        WHERE datetime IS NOT NULL
+        WINDOW w AS (ORDER BY datetime)
+        ORDER BY datetime
         """
 
         df = self.con.execute(sql, [symbol, start_d, end_d]).df()
-        df = self._attach_datetime_index(df)
-        return df
+        return df.set_index("datetime")
 
     def load_tick_trades(
         self,
@@ -183,7 +588,6 @@ class QuantDatabase:
         FROM tick_trades
         WHERE 万得代码 = ?
           AND trade_date = ?
-        ORDER BY 自然日, 时间
         """
 
         df = self.con.execute(sql, [symbol, d]).df()
@@ -207,7 +611,6 @@ class QuantDatabase:
         FROM tick_orders
         WHERE 万得代码 = ?
           AND trade_date = ?
-        ORDER BY 自然日, 时间
         """
 
         df = self.con.execute(sql, [symbol, d]).df()
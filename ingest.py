@@ -1,7 +1,18 @@
+import multiprocessing
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
 import duckdb
+import numpy as np
 import pandas as pd
-from config import DATA_ROOT, DB_PATH, FULL_REBUILD
+from config import DATA_ROOT, DB_PATH, FULL_REBUILD, IMPORT_ENGINE, IMPORT_PROCESSES, PARQUET_ROOT
 
 
 # ---------- DuckDB数据库 ----------
@@ -42,20 +53,60 @@ def ensure_import_log(con: duckdb.DuckDBPyConnection):
     )
 
 
+# 导入数据格式版本。2：编号/代码类列按原文保存（"000001"）；之前的版本先按数值解析再转字符串，
+# 前导零被去掉（"1"）。两种格式混在一张表里会让按这些列的过滤 / 关联失效，版本不同的库只能全量重建。
+IMPORT_FORMAT_VERSION = 2
+
+
+def check_import_format(con: duckdb.DuckDBPyConnection, full_rebuild: bool):
+    """
+    核对数据库的导入格式版本（记录在 import_meta 表）：
+    - 全量重建、或库里还没有数据表：写入当前版本
+    - 增量导入到没有版本记录 / 版本不同的库：抛出 RuntimeError，提示设置 full_rebuild = true
+    """
+    con.execute("CREATE TABLE IF NOT EXISTS import_meta (key TEXT PRIMARY KEY, value TEXT)")
+    row = con.execute("SELECT value FROM import_meta WHERE key = 'format_version'").fetchone()
+    version = int(row[0]) if row else None
+    has_data = any(table_exists(con, t) for t in ("quotes", "tick_trades", "tick_orders"))
+    if not full_rebuild and has_data and version != IMPORT_FORMAT_VERSION:
+        raise RuntimeError(
+            f"数据库的导入格式版本为 {version}，当前为 {IMPORT_FORMAT_VERSION}"
+            "（编号/代码类列改为保留前导零）。增量导入会让新旧格式混在同一张表里，"
+            "请在配置 [import] 中设置 full_rebuild = true 全量重建一次。"
+        )
+    con.execute(
+        "INSERT OR REPLACE INTO import_meta VALUES ('format_version', ?)",
+        [str(IMPORT_FORMAT_VERSION)],
+    )
+
+
 # ---------- 公共清洗逻辑 ----------
 
 KEYWORDS_STR_COL = ["编号", "代码", "序号", "委托号"]  # 名字含这些字的列一律转字符串
 
 
+@lru_cache(maxsize=None)
+def _id_like_cols(header: Tuple[str, ...]) -> Tuple[str, ...]:
+    """表头中的编号/代码类列。同一类 CSV 表头相同，关键字扫描每种表头只做一次。"""
+    return tuple(c for c in header if any(kw in c for kw in KEYWORDS_STR_COL))
+
+
+def _id_like_dtypes(header: Sequence[str]) -> Dict[str, str]:
+    """按表头返回编号/代码类列的 read_csv dtype（{列名: "string"}）"""
+    return {c: "string" for c in _id_like_cols(tuple(header))}
+
+
 def _force_id_like_columns_to_str(df: pd.DataFrame) -> pd.DataFrame:
     """
     把所有“编号 / 代码 / 序号 / 委托号”相关的列统一转成字符串。
     这些字段本质是 ID，不需要做数值运算，避免 uint64/int64 溢出。
+    已经是字符串的列（如读取时已按字符串解析）不再重复转换，其余列一次 astype 完成。
     """
-    for col in df.columns:
-        if any(kw in col for kw in KEYWORDS_STR_COL):
-            df[col] = df[col].astype("string")
-    return df
+    casts = {
+        col: "string" for col in _id_like_cols(tuple(df.columns))
+        if not pd.api.types.is_string_dtype(df[col])
+    }
+    return df.astype(casts) if casts else df
 
 
 def _drop_header_like_rows(df: pd.DataFrame) -> pd.DataFrame:
@@ -66,10 +117,18 @@ def _drop_header_like_rows(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
 
-    mask = pd.Series(False, index=df.index)
-    for col in df.columns:
-        mask |= (df[col].astype(str) == col)
-    return df[~mask].copy()
+    # 数值列里不可能出现列名文本，只逐列比较非数值列，结果 OR 进一个布尔数组：
+    # 字符串列直接与列名做向量化比较，不再把所有文本列整体复制成一份 str 数据
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.select_dtypes(exclude="number").columns:
+        values = df[col]
+        if not pd.api.types.is_string_dtype(values):
+            values = values.astype(str)
+        mask |= (values == col).to_numpy(dtype=bool, na_value=False)
+    if not mask.any():
+        return df
+    # take 按位置取行只拷贝一次，结果不带“切片副本”标记，后续加列不需要再 copy()
+    return df.take(np.flatnonzero(~mask))
 
 
 def _common_clean(df: pd.DataFrame) -> pd.DataFrame:
@@ -90,21 +149,29 @@ def _common_clean(df: pd.DataFrame) -> pd.DataFrame:
     if "自然日" not in df.columns:
         raise ValueError("CSV 中找不到 '自然日' 列，无法生成 trade_date")
 
+    # 整个文件只有少数几个交易日：先取唯一值，清洗/校验/解析只在唯一值上做，再按编码映射回各行
+    codes, uniq = pd.factorize(df["自然日"])  # 缺失值编码为 -1
+
     # 原始自然日 → 字符串，去空格，把类似 20250102.0 结尾的 .0 去掉
     s = (
-        df["自然日"]
+        pd.Series(uniq)
         .astype(str)
         .str.strip()
         .str.replace(r"\.0$", "", regex=True)
     )
 
     # 只保留“正好 8 位数字”的字符串；其他视为非法日期整行丢弃
-    mask_valid = s.str.match(r"^\d{8}$")
-    df = df[mask_valid].copy()
-    s = s[mask_valid]
-
-    # 此时 s 里都是 20250102 这种：按 %Y%m%d 解析
-    df["trade_date"] = pd.to_datetime(s, format="%Y%m%d").dt.date
+    valid = s.str.match(r"^\d{8}$").to_numpy(dtype=bool)
+    keep = codes >= 0
+    keep[keep] = valid[codes[keep]]
+    codes = codes[keep]
+    df = df.take(np.flatnonzero(keep))
+
+    # 此时合法的都是 20250102 这种：按 %Y%m%d 解析
+    dates = pd.to_datetime(s[valid], format="%Y%m%d").dt.date
+    mapping = np.empty(len(uniq), dtype=object)
+    mapping[valid] = dates.to_numpy()
+    df["trade_date"] = mapping[codes]
 
     # 3) 把“编号/代码/序号/委托号”相关列统一转字符串
     df = _force_id_like_columns_to_str(df)
@@ -112,136 +179,679 @@ def _common_clean(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+QUOTE_TRADE_COLS = ["成交价", "成交量", "成交额", "成交笔数"]
+
+
 # 行情专用过滤：剔除成交价/量/额/笔数为 0 的行
 def _filter_zero_trades_in_quotes(df: pd.DataFrame) -> pd.DataFrame:
-    cols = ["成交价", "成交量", "成交额", "成交笔数"]
+    cols = QUOTE_TRADE_COLS
     missing = [c for c in cols if c not in df.columns]
     if missing:
         raise ValueError(f"行情数据中缺少这些列: {missing}")
 
-    for c in cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
+    df[cols] = df[cols].apply(pd.to_numeric, errors="coerce")
 
-    mask = (df[cols] != 0).all(axis=1)
-    return df[mask].copy()
+    # 4 列取成连续的 float64 二维数组，一次比较 + 一次按行归约
+    arr = np.ascontiguousarray(df[cols].to_numpy(dtype=np.float64, na_value=np.nan))
+    mask = np.all(arr != 0, axis=1)
+    return df.take(np.flatnonzero(mask))
 
 
 # ---------- 三类 CSV 读取 ----------
 
-def load_quotes_csv(csv_path: Path) -> pd.DataFrame:
+CSV_CHUNK_THRESHOLD = 256 * 1024 * 1024  # 超过该大小（字节）的文件分块读取
+CSV_CHUNK_ROWS = 500_000                 # 分块读取时每块行数
+
+
+def _read_csv(csv_path: Path, header: pd.Index, dtype) -> pd.DataFrame:
+    """
+    读取 GBK 编码的 CSV。
+    优先用 pyarrow.csv（多线程 C++ 解析，峰值内存更低）；
+    未安装 pyarrow，或文件后段出现重复表头导致类型推断冲突时，回退到 pandas 自带解析器。
+
+    列名沿用 pandas 解析出的表头（空列名 → Unnamed: N，重名 → a.1），与回退路径一致；
+    字符串列在 Arrow 侧直接按 string 解析——pandas 的 pyarrow 引擎会先推断成整数再转换，
+    000001 之类的代码会丢掉前导零。
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+
+        str_cols = list(header) if dtype is str else list(dtype)
+        table = pa_csv.read_csv(
+            csv_path,
+            read_options=pa_csv.ReadOptions(encoding="gbk", column_names=list(header), skip_rows=1),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={c: pa.string() for c in str_cols},
+                strings_can_be_null=True,
+            ),
+        )
+        # 整列为空的列 pyarrow 推断为 null 类型（转成 pandas 后是 object，写入 DuckDB 为 INTEGER）；
+        # pandas 解析器读成 float64 NaN，这里同样转为 float64，表结构与回退路径一致
+        for i, field in enumerate(table.schema):
+            if pa.types.is_null(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+        df = table.to_pandas()
+        return df if dtype is str else df.astype(dtype)
+    except (ImportError, ValueError):  # pyarrow.ArrowInvalid 是 ValueError 的子类
+        return pd.read_csv(csv_path, encoding="gbk", low_memory=False, dtype=dtype)
+
+
+def _iter_csv(csv_path: Path, raw: bool = False) -> Iterator[pd.DataFrame]:
+    """
+    按块产出 CSV 原始数据：
+    小文件整体读取（一块）；大文件按 CSV_CHUNK_ROWS 行分块，峰值内存不随文件大小增长。
+    编号/代码类列在解析时直接读成字符串，无需事后整列转换。
+    raw=True 时所有列都读成字符串、不做类型推断，类型由 SQL 清洗负责（见 _clean_select_sql）。
+    """
+    header = pd.read_csv(csv_path, encoding="gbk", nrows=0).columns
+    dtype = str if raw else _id_like_dtypes(header)
+
+    if csv_path.stat().st_size <= CSV_CHUNK_THRESHOLD:
+        yield _read_csv(csv_path, header, dtype)
+        return
+
+    yield from pd.read_csv(csv_path, encoding="gbk", chunksize=CSV_CHUNK_ROWS, dtype=dtype)
+
+
+def load_quotes_csv(csv_path: Path) -> Iterator[pd.DataFrame]:
     """
     行情.csv：
     万得代码, 交易所代码, 自然日, 时间, 成交价, 成交量, 成交额, 成交笔数, ...
     """
-    df = pd.read_csv(csv_path, encoding="gbk")
-    df = _common_clean(df)
-    df = _filter_zero_trades_in_quotes(df)
-    return df
+    for df in _iter_csv(csv_path):
+        df = _common_clean(df)
+        df = _filter_zero_trades_in_quotes(df)
+        yield df
 
 
-def load_tick_trades_csv(csv_path: Path) -> pd.DataFrame:
+def load_tick_trades_csv(csv_path: Path) -> Iterator[pd.DataFrame]:
     """
     逐笔成交.csv：
     万得代码, 交易所代码, 自然日, 时间, 成交编号, 成交代码, 委托代码, BS标志,
     成交价格, 成交数量, ...
     """
-    df = pd.read_csv(csv_path, encoding="gbk")
-    df = _common_clean(df)
-    return df
+    for df in _iter_csv(csv_path):
+        df = _common_clean(df)
+        yield df
 
 
-def load_tick_orders_csv(csv_path: Path) -> pd.DataFrame:
+def load_tick_orders_csv(csv_path: Path) -> Iterator[pd.DataFrame]:
     """
     逐笔委托.csv：
     万得代码, 交易所代码, 自然日, 时间, 委托编号, 交易所委托号, 委托类型,
     委托代码, 委托价格, 委托数量, ...
     """
-    df = pd.read_csv(csv_path, encoding="gbk")
-    df = _common_clean(df)
-    return df
+    for df in _iter_csv(csv_path):
+        df = _common_clean(df)
+        yield df
+
+
+# ---------- SQL 清洗（[import] engine = duckdb） ----------
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+_INT_PATTERN = r"\s*[+-]?\d+\s*"
+
+
+def _infer_types_sql(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    columns: Sequence[str],
+    where: str,
+) -> Dict[str, str]:
+    """
+    在已过滤掉表头行/非法日期行的原始字符串数据上推断列类型（一次聚合扫描）：
+    全部是整数 → BIGINT；全部可转浮点（或全为空） → DOUBLE；否则 VARCHAR。
+    """
+    if not columns:
+        return {}
+    aggs = []
+    for c in columns:
+        v = _ident(c)
+        aggs.append(
+            f"count({v}) > 0 AND coalesce(bool_and({v} IS NULL OR "
+            f"(regexp_full_match({v}, '{_INT_PATTERN}') AND TRY_CAST({v} AS BIGINT) IS NOT NULL)), true)"
+        )
+        aggs.append(f"coalesce(bool_and({v} IS NULL OR TRY_CAST({v} AS DOUBLE) IS NOT NULL), true)")
+    flags = con.execute(f"SELECT {', '.join(aggs)} FROM {source} WHERE {where}").fetchone()
+    return {
+        c: "BIGINT" if is_int else "DOUBLE" if is_float else "VARCHAR"
+        for c, is_int, is_float in zip(columns, flags[0::2], flags[1::2])
+    }
+
+
+def _is_unnamed(col: str) -> bool:
+    """表头为空的列：pandas 命名为 Unnamed: N，DuckDB read_csv 命名为 columnN"""
+    return col.startswith("Unnamed") or re.fullmatch(r"column\d+", col) is not None
+
+
+def _clean_select_sql(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    nonzero_cols: Sequence[str] = (),
+    target_types: Dict[str, str] = None,
+) -> str:
+    """
+    生成与 _common_clean（及行情 0 值过滤）等价的 SELECT，source 为已注册的原始数据：
+    1) 删除重复表头行（任一文本列的值 == 列名）
+    2) 去掉无列名的列（pandas 的 Unnamed: N / DuckDB read_csv 的 columnN）
+    3) 只保留 自然日 为 8 位日期的行，并生成 trade_date
+    4) 编号/代码类列转为 VARCHAR，其余文本列按 target_types（目标表结构）转换；
+       未给出时在 SQL 里推断，转换失败的值写为 NULL
+    5) nonzero_cols 转为数值（BIGINT / DOUBLE），任一列为 0 的行剔除（无法解析的值视为非 0，与 pandas 版一致）
+    """
+    types = {name: typ for name, typ, *_ in con.execute(f"DESCRIBE {source}").fetchall()}
+    if "自然日" not in types:
+        raise ValueError("CSV 中找不到 '自然日' 列，无法生成 trade_date")
+    missing = [c for c in nonzero_cols if c not in types]
+    if missing:
+        raise ValueError(f"行情数据中缺少这些列: {missing}")
+
+    date_str = rf"regexp_replace(trim(CAST({_ident('自然日')} AS VARCHAR)), '\.0$', '')"
+
+    conds = []
+    header_hits = [
+        f"coalesce(CAST({_ident(c)} AS VARCHAR) = {_literal(c)}, false)"
+        for c, typ in types.items() if typ == "VARCHAR"
+    ]
+    if header_hits:
+        conds.append("NOT (" + " OR ".join(header_hits) + ")")
+    conds.append(rf"regexp_full_match({date_str}, '\d{{8}}')")
+    conds.append(f"try_strptime({date_str}, '%Y%m%d') IS NOT NULL")
+    where = " AND ".join(conds)
+
+    keep = [c for c in types if not _is_unnamed(c)]
+    id_like = set(_id_like_dtypes(keep))
+    if target_types is None:
+        text_cols = [c for c in keep if c not in id_like and types[c] == "VARCHAR"]
+        target_types = _infer_types_sql(con, source, text_cols, where)
+
+    select = []
+    for col in keep:
+        if col in id_like:
+            expr = f"CAST({_ident(col)} AS VARCHAR)"
+        elif col in nonzero_cols and types[col] == "VARCHAR":
+            # 与 pd.to_numeric(errors="coerce") 一致：整数列为 BIGINT，其余为 DOUBLE（无法解析的值为 NULL）
+            typ = target_types.get(col, "DOUBLE")
+            expr = f"TRY_CAST({_ident(col)} AS {typ if typ in ('BIGINT', 'DOUBLE') else 'DOUBLE'})"
+        elif target_types.get(col, types[col]) != types[col]:
+            expr = f"TRY_CAST({_ident(col)} AS {target_types[col]})"
+        else:
+            expr = _ident(col)
+        select.append(f"{expr} AS {_ident(col)}")
+    select.append(f"CAST(strptime({date_str}, '%Y%m%d') AS DATE) AS trade_date")
+
+    for c in nonzero_cols:
+        where += f" AND coalesce(TRY_CAST({_ident(c)} AS DOUBLE) <> 0, true)"
+
+    return (
+        f"SELECT {', '.join(select)}\n"
+        f"FROM {source}\n"
+        f"WHERE {where}"
+    )
+
+
+def _insert_from_source(
+    con: duckdb.DuckDBPyConnection,
+    table_name: str,
+    source: str,
+    create: bool,
+    nonzero_cols: Sequence[str] = (),
+) -> int:
+    """
+    把已注册的原始数据 source 清洗后写入 table_name，清洗、过滤与写入在一条 SQL 里完成。
+    建表时列类型由 SQL 推断；表已存在时按表结构转换。返回写入行数。
+    """
+    if create:
+        select_sql = _clean_select_sql(con, source, nonzero_cols)
+        sql = f"CREATE TABLE {table_name} AS {select_sql}"
+    else:
+        target_types = {
+            name: typ for name, typ, *_ in con.execute(f"DESCRIBE {table_name}").fetchall()
+        }
+        select_sql = _clean_select_sql(con, source, nonzero_cols, target_types)
+        sql = f"INSERT INTO {table_name} BY NAME {select_sql}"
+    return con.execute(sql).fetchone()[0]
+
+
+def _insert_clean_sql(
+    con: duckdb.DuckDBPyConnection,
+    table_name: str,
+    raw_df: pd.DataFrame,
+    create: bool,
+    nonzero_cols: Sequence[str] = (),
+) -> int:
+    """
+    原始数据注册为 DuckDB 视图（零拷贝）后清洗写入，返回写入行数。
+    """
+    con.register("tmp_raw", raw_df)
+    try:
+        return _insert_from_source(con, table_name, "tmp_raw", create, nonzero_cols)
+    finally:
+        con.unregister("tmp_raw")
+
+
+def _duckdb_reads_gbk(con: duckdb.DuckDBPyConnection) -> bool:
+    """
+    DuckDB 本身只能解析 UTF-8/Latin-1；已安装 encodings 扩展（INSTALL encodings）时才能直接读 GBK。
+    这里只尝试 LOAD，不会联网下载。
+    """
+    try:
+        con.execute("LOAD encodings")
+        return True
+    except duckdb.Error:
+        return False
+
+
+_SRC_COL = "_src"  # 多文件 read_csv 时记录来源文件的列，只在导入过程中使用，不写入目标表
+
+
+def _insert_csv_sql(
+    con: duckdb.DuckDBPyConnection,
+    table_name: str,
+    csv_paths: Sequence[Path],
+    create: bool,
+    nonzero_cols: Sequence[str] = (),
+) -> Dict[Path, int]:
+    """
+    由 DuckDB 一次性解析全部 CSV（多文件并行扫描、不经过 pandas），所有列按字符串读入，
+    列按名称对齐（union_by_name），再走与 _insert_clean_sql 相同的 SQL 清洗写入。
+    返回每个文件写入的行数。
+    """
+    files = [str(p) for p in csv_paths]
+    con.execute(
+        f"""
+        CREATE OR REPLACE TEMP VIEW tmp_raw_csv AS
+        SELECT * FROM read_csv([{', '.join(_literal(f) for f in files)}],
+                               encoding = 'gbk', header = true, all_varchar = true,
+                               union_by_name = true, filename = {_literal(_SRC_COL)})
+        """
+    )
+    try:
+        target_types = None
+        if not create:
+            target_types = {
+                name: typ for name, typ, *_ in con.execute(f"DESCRIBE {table_name}").fetchall()
+            }
+        select_sql = _clean_select_sql(con, "tmp_raw_csv", nonzero_cols, target_types)
+        con.execute(f"CREATE OR REPLACE TEMP TABLE tmp_clean_csv AS {select_sql}")
+
+        rows_sql = f"SELECT * EXCLUDE ({_ident(_SRC_COL)}) FROM tmp_clean_csv"
+        if create:
+            con.execute(f"CREATE TABLE {table_name} AS {rows_sql}")
+        else:
+            con.execute(f"INSERT INTO {table_name} BY NAME {rows_sql}")
+
+        counts = dict(con.execute(
+            f"SELECT {_ident(_SRC_COL)}, count(*) FROM tmp_clean_csv GROUP BY ALL"
+        ).fetchall())
+    finally:
+        con.execute("DROP TABLE IF EXISTS tmp_clean_csv")
+        con.execute("DROP VIEW IF EXISTS tmp_raw_csv")
+    return {p: counts.get(f, 0) for p, f in zip(csv_paths, files)}
+
+
+# ---------- 文件发现 ----------
+
+def iter_files(root: Path, pattern: str) -> Iterator[Path]:
+    """
+    递归遍历 root，按目录逐层产出文件名匹配 pattern 的文件（每层按名称排序，顺序稳定；不跟随符号链接）。
+    一次只在内存里保留一个目录的条目，找到第一个文件即可开始导入。
+    """
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_files(Path(entry.path), pattern)
+        elif fnmatch(entry.name, pattern):
+            yield Path(entry.path)
+
+
+# ---------- 并行读取 ----------
+
+INGEST_WORKERS = min(4, os.cpu_count() or 1)  # 并行解析 CSV 的线程数
+INGEST_PROCESS_WORKERS = os.cpu_count() or 1  # processes = true 时的进程数
+INGEST_QUEUE_CHUNKS = 2                       # 每个文件最多预读的分块数（限制内存）
+
+_DONE = object()
+
+
+def _prefetch_chunks(
+    files: Iterable[Path],
+    loader: Callable[[Path], Iterator[pd.DataFrame]],
+    workers: int = INGEST_WORKERS,
+) -> Iterator[Tuple[Path, Iterator[pd.DataFrame]]]:
+    """
+    用线程池并行解析多个文件（pandas/pyarrow 解析期间释放 GIL），按原顺序产出 (文件, 分块迭代器)。
+    files 可以是惰性迭代器：只向前取 workers 个文件交给线程池；
+    每个文件一个有界队列，预读量不超过 workers × INGEST_QUEUE_CHUNKS 块。
+    写库仍由调用方在单线程里顺序完成。
+    """
+    stop = threading.Event()
+
+    def produce(csv_file: Path, q: "queue.Queue") -> None:
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for df in loader(csv_file):
+                if not put(df):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(_DONE)
+
+    def consume(q: "queue.Queue") -> Iterator[pd.DataFrame]:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    workers = max(1, workers)
+    files = iter(files)
+    pending: deque = deque()
+
+    def fill() -> None:
+        while len(pending) <= workers:
+            csv_file = next(files, None)
+            if csv_file is None:
+                return
+            q = queue.Queue(maxsize=INGEST_QUEUE_CHUNKS)
+            pool.submit(produce, csv_file, q)
+            pending.append((csv_file, q))
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+    try:
+        fill()
+        while pending:
+            csv_file, q = pending.popleft()
+            yield csv_file, consume(q)
+            fill()
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _load_file(loader: Callable[[Path], Iterator[pd.DataFrame]], csv_file: Path) -> List[pd.DataFrame]:
+    """进程池 worker：读取并清洗整个文件，返回全部分块"""
+    return list(loader(csv_file))
+
+
+def _prefetch_chunks_processes(
+    files: Iterable[Path],
+    loader: Callable[[Path], Iterator[pd.DataFrame]],
+    workers: int = INGEST_PROCESS_WORKERS,
+) -> Iterator[Tuple[Path, Iterator[pd.DataFrame]]]:
+    """
+    与 _prefetch_chunks 接口相同，但解析和清洗都在子进程里完成（pandas 清洗持有 GIL，线程无法并行）。
+    子进程用 spawn 启动，不继承父进程的 DuckDB 连接；loader 须可 pickle（模块级函数或 partial）。
+    每个文件的分块整体传回主进程，同时在途的文件不超过 workers + 1 个。
+    """
+    workers = max(1, workers)
+    files = iter(files)
+    pending: deque = deque()
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        def fill() -> None:
+            while len(pending) <= workers:
+                csv_file = next(files, None)
+                if csv_file is None:
+                    return
+                pending.append((csv_file, pool.submit(_load_file, loader, csv_file)))
+
+        try:
+            fill()
+            while pending:
+                csv_file, future = pending.popleft()
+                yield csv_file, iter(future.result())
+                fill()
+        finally:
+            for _, future in pending:
+                future.cancel()
 
 
 # ---------- 通用导入（支持全量 & 增量） ----------
 
+_IMPORT_LOG_SQL = """
+INSERT OR REPLACE INTO import_log
+    (file_path, table_name, file_mtime, imported_at, rows_imported)
+VALUES (?, ?, ?, now(), ?)
+"""
+
 def ingest_category(
     con: duckdb.DuckDBPyConnection,
     file_pattern: str,
     table_name: str,
     loader_func,
     full_rebuild: bool,
+    engine: str = "pandas",
+    nonzero_cols: Sequence[str] = (),
+    processes: bool = False,
 ):
     """
     file_pattern: 匹配的文件名，例如 "行情.csv" / "逐笔成交.csv" / "逐笔委托.csv"
     table_name:   DuckDB 里的目标表名
-    loader_func:  对应的 pandas 读取函数
+    loader_func:  对应的 pandas 读取函数，按块产出清洗后的 DataFrame
     full_rebuild: True=本次全量重建，False=增量导入
+    engine:       "pandas"=用 loader_func 清洗；"duckdb"=原始数据按字符串读入，类型转换与清洗交给 SQL
+                  （装有 DuckDB encodings 扩展时由 DuckDB 直接解析 CSV）
+    nonzero_cols: engine="duckdb" 时需剔除 0 值的列（行情为 QUOTE_TRADE_COLS）
+    processes:    True=用进程池解析/清洗 CSV，False=用线程池
+    返回本次导入的文件数。
     """
-    files = sorted(DATA_ROOT.rglob(file_pattern))
-    print(f"[{table_name}] 在 {DATA_ROOT} 下找到 {len(files)} 个 {file_pattern} 文件")
-    if not files:
-        print(f"[{table_name}] 没找到任何 {file_pattern}，跳过。")
-        return
-
     table_already_exists = table_exists(con, table_name)
-
-    for csv_file in files:
-        csv_path_str = str(csv_file)
-        mtime = csv_file.stat().st_mtime  # 文件修改时间（秒）
-
-        if not full_rebuild:
-            # 增量模式：检查 import_log 里是否已有该文件记录且 mtime 未变化
-            row = con.execute(
-                """
-                SELECT file_mtime FROM import_log
-                WHERE file_path = ? AND table_name = ?
-                """,
-                [csv_path_str, table_name],
-            ).fetchone()
-            if row is not None and abs(row[0] - mtime) < 1e-6:
+    found = 0
+    imported = 0
+    mtimes: Dict[Path, float] = {}
+
+    # 增量模式：一次取出该表已导入文件的 mtime，遍历时在本地字典里比对
+    seen: Dict[str, float] = {}
+    if not full_rebuild:
+        seen = dict(con.execute(
+            "SELECT file_path, file_mtime FROM import_log WHERE table_name = ?",
+            [table_name],
+        ).fetchall())
+
+    # 边遍历目录边筛出需要导入的文件（主线程），交给线程池 / 进程池并行解析
+    def todo() -> Iterator[Path]:
+        nonlocal found
+        for csv_file in iter_files(DATA_ROOT, file_pattern):
+            found += 1
+            csv_path_str = str(csv_file)
+            mtime = csv_file.stat().st_mtime  # 文件修改时间（秒）
+
+            # 已有导入记录且 mtime 未变化的文件跳过
+            prev = seen.get(csv_path_str)
+            if prev is not None and abs(prev - mtime) < 1e-6:
                 print(f"[{table_name}] 跳过已导入且未修改: {csv_path_str}")
                 continue
 
+            mtimes[csv_file] = mtime
+            yield csv_file
+
+    if engine == "duckdb" and _duckdb_reads_gbk(con):
+        # DuckDB 一条 SQL 解析并写入全部待导入文件（内部已多线程），不再经过 pandas 和预读线程池
+        print(f"[{table_name}] 使用 DuckDB read_csv 直接解析 CSV")
+        csv_files = list(todo())
+        if csv_files:
+            for csv_file in csv_files:
+                print(f"[{table_name}] 导入: {csv_file}")
+
+            # 整批文件在同一事务里，中途失败不会留下部分文件的数据
+            con.begin()
+            try:
+                rows_by_file = _insert_csv_sql(
+                    con, table_name, csv_files, not table_already_exists, nonzero_cols
+                )
+                for csv_file, rows in rows_by_file.items():
+                    if rows == 0:
+                        print(f"[{table_name}] {csv_file} 过滤后为空，跳过。")
+                con.executemany(
+                    _IMPORT_LOG_SQL,
+                    [[str(f), table_name, mtimes.pop(f), rows] for f, rows in rows_by_file.items()],
+                )
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+            imported = len(csv_files)
+        files_and_chunks = ()
+    else:
+        loader = partial(_iter_csv, raw=True) if engine == "duckdb" else loader_func
+        prefetch = _prefetch_chunks_processes if processes else _prefetch_chunks
+        files_and_chunks = prefetch(todo(), loader)
+
+    for csv_file, chunks in files_and_chunks:
+        csv_path_str = str(csv_file)
+        mtime = mtimes.pop(csv_file)
+
         print(f"[{table_name}] 导入: {csv_path_str}")
-        df = loader_func(csv_file)
-        rows = len(df)
-
-        if rows == 0:
-            print(f"[{table_name}] {csv_path_str} 过滤后为空，跳过。")
-            con.execute(
-                """
-                INSERT OR REPLACE INTO import_log
-                    (file_path, table_name, file_mtime, imported_at, rows_imported)
-                VALUES (?, ?, ?, now(), ?)
-                """,
-                [csv_path_str, table_name, mtime, 0],
-            )
-            continue
-
-        con.register("tmp_import", df)
-
-        if not table_already_exists:
-            # 第一次导入该表：根据 df 结构创建表
-            con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM tmp_import")
-            table_already_exists = True
-        else:
-            # 表已存在：按列名插入
-            con.execute(
-                f"INSERT INTO {table_name} BY NAME SELECT * FROM tmp_import"
-            )
+        rows = 0
+
+        # 一个文件的所有分块放在同一事务里，中途失败不会留下半个文件的数据
+        con.begin()
+        try:
+            for df in chunks:
+                if df.empty:
+                    continue
+
+                if engine == "duckdb":
+                    rows += _insert_clean_sql(
+                        con, table_name, df, not table_already_exists, nonzero_cols
+                    )
+                    table_already_exists = True
+                    continue
+
+                if not table_already_exists:
+                    # 第一次导入该表：根据 df 结构创建表
+                    con.register("tmp_import", df)
+                    con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM tmp_import")
+                    con.unregister("tmp_import")
+                    table_already_exists = True
+                else:
+                    # 表已存在：走 DuckDB appender 按列名批量追加
+                    con.append(table_name, df, by_name=True)
+                rows += len(df)
+
+            if rows == 0:
+                print(f"[{table_name}] {csv_path_str} 过滤后为空，跳过。")
+
+            # 记录 / 更新 import_log
+            con.execute(_IMPORT_LOG_SQL, [csv_path_str, table_name, mtime, rows])
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        imported += 1
+
+    print(f"[{table_name}] 在 {DATA_ROOT} 下找到 {found} 个 {file_pattern} 文件")
+    if not found:
+        print(f"[{table_name}] 没找到任何 {file_pattern}，跳过。")
+        return 0
+    print(f"[{table_name}] 导入完成。")
+    return imported
+
+
+# ---------- 按查询键重排 ----------
+
+CLUSTER_NEW_ROW_FRACTION = 0.2  # 增量导入的新行占整表的比例达到该值时才重排整表
 
-        con.unregister("tmp_import")
 
-        # 记录 / 更新 import_log
+def table_rows(con: duckdb.DuckDBPyConnection, table_name: str) -> int:
+    """表的行数，表不存在时为 0"""
+    if not table_exists(con, table_name):
+        return 0
+    return con.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+
+
+def needs_cluster(rows_before: int, rows_after: int) -> bool:
+    """
+    本次导入后是否重排整表：重排要重写整张表，代价与表的总行数成正比，
+    因此只在表是本次新建 / 全量重建（导入前为空）、或新增行达到 CLUSTER_NEW_ROW_FRACTION 时进行；
+    零星的增量导入只追加到表尾，查询照常正确，只是这部分行暂时不在聚集顺序里。
+    """
+    new_rows = rows_after - rows_before
+    if new_rows <= 0:
+        return False
+    return rows_before == 0 or new_rows >= CLUSTER_NEW_ROW_FRACTION * rows_after
+
+
+def cluster_table(con: duckdb.DuckDBPyConnection, table_name: str):
+    """
+    按 (万得代码, trade_date, 时间) 重写整张表，并在 (万得代码, trade_date) 上建索引。
+    查询都按股票 + 日期过滤：数据按这两列聚在一起后，row group 的 min/max 统计可以跳过无关数据，
+    读出的行也已按时间排好。同一时间的多行保持原导入顺序（rowid）。
+    整表重写的代价是 O(总行数)，是否调用由 needs_cluster 决定（见 ingest_all）。
+    """
+    if not table_exists(con, table_name):
+        return
+    con.begin()
+    try:
         con.execute(
+            f"""
+            CREATE TABLE {table_name}_sorted AS
+            SELECT * FROM {table_name}
+            ORDER BY 万得代码, trade_date, 时间, rowid
             """
-            INSERT OR REPLACE INTO import_log
-                (file_path, table_name, file_mtime, imported_at, rows_imported)
-            VALUES (?, ?, ?, now(), ?)
-            """,
-            [csv_path_str, table_name, mtime, rows],
         )
+        con.execute(f"DROP TABLE {table_name}")
+        con.execute(f"ALTER TABLE {table_name}_sorted RENAME TO {table_name}")
+        con.execute(f"CREATE INDEX idx_{table_name}_symbol_date ON {table_name} (万得代码, trade_date)")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
 
-    print(f"[{table_name}] 导入完成。")
+
+# ---------- Parquet 分区导出 ----------
+
+PARQUET_ROW_GROUP_SIZE = 100_000  # 每个 row group 的行数，min/max 统计按 row group 记录
+
+def needs_export(root: Path, table_name: str, n_files: int) -> bool:
+    """
+    本次导入后是否重新导出该表：导出覆盖整张表的全部分区，代价与表的总行数成正比，
+    因此只在本次导入了文件（全量重建也会导入）、或 root 下还没有该表的导出时进行。
+    没有变化的表不重写分区，分区文件的 mtime 不变，QuantDatabase 里按 mtime 失效的查询缓存也保持有效。
+    """
+    return n_files > 0 or not (root / table_name).is_dir()
+
+
+def export_parquet(con: duckdb.DuckDBPyConnection, table_name: str, root: Path) -> int:
+    """
+    把整张表导出为 root/<table_name>/trade_date=.../symbol=.../*.parquet（Hive 分区）。
+    万得代码 以 ASCII 列名 symbol 作为分区键写入路径（中文分区名会被 URL 编码，读取时无法还原），
+    列存 + ZSTD 压缩，读取方式见 QuantDatabase。每次整表覆盖（是否调用由 needs_export 决定），返回导出行数。
+    """
+    if not table_exists(con, table_name):
+        return 0
+    target = root / table_name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    return con.execute(
+        f"""
+        COPY (SELECT * EXCLUDE (万得代码), 万得代码 AS symbol FROM {table_name})
+        TO {_literal(str(target))}
+        (FORMAT PARQUET, PARTITION_BY (trade_date, symbol), OVERWRITE,
+         COMPRESSION ZSTD, ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE})
+        """
+    ).fetchone()[0]
 
 
 # ---------- 主入口：三种 CSV 一次性导入 ----------
@@ -250,11 +860,14 @@ def ingest_all():
     print("DATA_ROOT:", DATA_ROOT)
     print("DB_PATH  :", DB_PATH)
     print("FULL_REBUILD:", FULL_REBUILD)
+    print("IMPORT_ENGINE:", IMPORT_ENGINE)
+    print("IMPORT_PROCESSES:", IMPORT_PROCESSES)
 
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
     con = duckdb.connect(str(DB_PATH))
     ensure_import_log(con)
+    check_import_format(con, FULL_REBUILD)
 
     if FULL_REBUILD:
         print("FULL_REBUILD = True，先删除旧表并清空 import_log。")
@@ -263,9 +876,32 @@ def ingest_all():
         drop_table_if_needed(con, "tick_orders")
         con.execute("DELETE FROM import_log")
 
-    ingest_category(con, "行情.csv",   "quotes",      load_quotes_csv,      FULL_REBUILD)
-    ingest_category(con, "逐笔成交.csv", "tick_trades", load_tick_trades_csv, FULL_REBUILD)
-    ingest_category(con, "逐笔委托.csv", "tick_orders", load_tick_orders_csv, FULL_REBUILD)
+    tables = ("quotes", "tick_trades", "tick_orders")
+    rows_before = {t: table_rows(con, t) for t in tables}
+    imported = {
+        "quotes": ingest_category(con, "行情.csv", "quotes", load_quotes_csv, FULL_REBUILD,
+                                  IMPORT_ENGINE, QUOTE_TRADE_COLS, IMPORT_PROCESSES),
+        "tick_trades": ingest_category(con, "逐笔成交.csv", "tick_trades", load_tick_trades_csv,
+                                       FULL_REBUILD, IMPORT_ENGINE, processes=IMPORT_PROCESSES),
+        "tick_orders": ingest_category(con, "逐笔委托.csv", "tick_orders", load_tick_orders_csv,
+                                       FULL_REBUILD, IMPORT_ENGINE, processes=IMPORT_PROCESSES),
+    }
+
+    # 新建 / 全量重建、或新增数据足够多的表按查询键重排（增量追加的行排在表尾）
+    for table_name, n_files in imported.items():
+        if n_files and needs_cluster(rows_before[table_name], table_rows(con, table_name)):
+            print(f"[{table_name}] 按 万得代码, trade_date, 时间 重排并建索引")
+            cluster_table(con, table_name)
+
+    # 导出同样是整表重写：只导出本次有导入（含全量重建）或还没有导出过的表
+    if PARQUET_ROOT is not None:
+        print("PARQUET_ROOT:", PARQUET_ROOT)
+        for table_name in tables:
+            if not needs_export(PARQUET_ROOT, table_name, imported[table_name]):
+                print(f"[{table_name}] 没有新导入的文件，Parquet 保持不变")
+                continue
+            rows = export_parquet(con, table_name, PARQUET_ROOT)
+            print(f"[{table_name}] 导出 Parquet: {rows} 行")
 
     con.close()
     print("全部导入完成。")
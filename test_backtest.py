@@ -4,32 +4,48 @@
 
 import sys
 import os
+import io
+import contextlib
+from functools import cache
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import duckdb
+import pytest
 from database import QuantDatabase
 from backtest.data_adapter import DataAdapter
+from backtest import Backtesting, Broker
+from backtest.strategies import MovingAverageStrategy
+import numpy as np
 import pandas as pd
 
-def test_data_adapter():
+@cache
+def _mock_quotes() -> pd.DataFrame:
+    """数据库中没有测试数据时使用的模拟行情（10 根 1 分钟 bar），进程内只构造一次"""
+    df = pd.DataFrame({
+        '万得代码': ['000001.SZ'] * 10,
+        '成交价': [10.0, 10.1, 10.2, 10.1, 10.0, 9.9, 10.0, 10.1, 10.2, 10.3],
+        '最高价': [10.1, 10.2, 10.3, 10.2, 10.1, 10.0, 10.1, 10.2, 10.3, 10.4],
+        '最低价': [9.9, 10.0, 10.1, 10.0, 9.9, 9.8, 9.9, 10.0, 10.1, 10.2],
+        '成交量': [1000, 1500, 2000, 1200, 800, 1000, 1500, 2000, 1800, 2200],
+        '成交额': [10000, 15150, 20400, 12120, 8000, 9900, 15000, 20200, 18360, 22660]
+    })
+    df.index = pd.date_range('2025-01-02 09:30:00', periods=10, freq='1min')
+    return df
+
+def test_data_adapter(db):
     """测试数据适配器"""
     print("=== 测试数据适配器 ===")
     
-    # 加载一些测试数据
-    db = QuantDatabase(read_only=True)
-    df = db.load_quotes('000001.SZ', '2025-01-02', '2025-01-02')
+    # 加载一些测试数据（没有数据库时 db 为 None）
+    if db is None:
+        df = pd.DataFrame()
+    else:
+        df = db.load_quotes('000001.SZ', '2025-01-02', '2025-01-02',
+                            columns=['万得代码', '成交价', '最高价', '最低价', '成交量', '成交额'])
     
     if df.empty:
         print("没有找到测试数据，使用模拟数据")
-        # 创建模拟数据
-        df = pd.DataFrame({
-            '万得代码': ['000001.SZ'] * 10,
-            '成交价': [10.0, 10.1, 10.2, 10.1, 10.0, 9.9, 10.0, 10.1, 10.2, 10.3],
-            '最高价': [10.1, 10.2, 10.3, 10.2, 10.1, 10.0, 10.1, 10.2, 10.3, 10.4],
-            '最低价': [9.9, 10.0, 10.1, 10.0, 9.9, 9.8, 9.9, 10.0, 10.1, 10.2],
-            '成交量': [1000, 1500, 2000, 1200, 800, 1000, 1500, 2000, 1800, 2200],
-            '成交额': [10000, 15150, 20400, 12120, 8000, 9900, 15000, 20200, 18360, 22660]
-        })
-        df.index = pd.date_range('2025-01-02 09:30:00', periods=10, freq='1min')
+        df = _mock_quotes()
     
     print("原始数据列名:", list(df.columns))
     print("数据形状:", df.shape)
@@ -40,55 +56,348 @@ def test_data_adapter():
     
     # 测试单个bar转换
     if not df.empty:
-        bar = df.iloc[0]
-        bar_dict = DataAdapter.create_bar_dict(bar)
-        print("单个bar转换结果:")
-        for key, value in bar_dict.items():
-            if key in ['close', 'high', 'low', 'volume', 'symbol']:
-                print(f"  {key}: {value}")
+        bar = next(DataAdapter.iter_bars(df))
+        keys = ('close', 'high', 'low', 'volume', 'symbol')
+        print("单个bar转换结果:\n" + "\n".join(f"  {k}: {getattr(bar, k)}" for k in keys if hasattr(bar, k)))
     
-    db.close()
     print("数据适配器测试完成！\n")
 
-def test_backtest_integration():
+def test_backtest_integration(db):
     """测试回测集成"""
     print("=== 测试回测集成 ===")
     
-    try:
-        from backtest.utils import run_backtest
-        from backtest.strategies import MovingAverageStrategy
-        
-        print("尝试运行回测...")
-        
-        # 尝试运行回测
-        analysis = run_backtest(
-            symbol="000001.SZ",
-            start_date="2025-01-02",
-            end_date="2025-01-02",
-            strategy_class=MovingAverageStrategy,
-            short_window=3,
-            long_window=5,
-            initial_cash=100000
-        )
-        
-        if analysis:
-            print("回测运行成功！")
-            analysis.print_summary()
-        else:
-            print("回测返回None，可能没有数据")
-            
-    except Exception as e:
-        print(f"回测运行出错: {e}")
-        print("错误类型:", type(e).__name__)
-        import traceback
-        traceback.print_exc()
+    if db is None:
+        pytest.skip("没有数据库文件，跳过回测集成测试")
+    
+    from backtest.utils import run_backtest
+    from backtest.strategies import MovingAverageStrategy
+    
+    print("尝试运行回测...")
+    
+    # 运行回测：出错直接抛出，测试失败
+    analysis = run_backtest(
+        symbol="000001.SZ",
+        start_date="2025-01-02",
+        end_date="2025-01-02",
+        strategy_class=MovingAverageStrategy,
+        short_window=3,
+        long_window=5,
+        initial_cash=100000,
+        db=db
+    )
+    
+    if analysis:
+        print("回测运行成功！")
+        analysis.print_summary()
+    else:
+        print("回测返回None，可能没有数据")
     
     print("回测集成测试完成！\n")
 
+def _random_quotes(n: int, seed: int = 0) -> pd.DataFrame:
+    """随机游走的单只股票分笔行情（数据库列名），用于不依赖数据库的断言测试"""
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.001, n))), 2)
+    df = pd.DataFrame({
+        '万得代码': '000001.SZ',
+        '成交价': close,
+        '最高价': close + 0.01,
+        '最低价': close - 0.01,
+        '成交量': 100
+    })
+    df.index = pd.date_range('2025-01-02 09:30:00', periods=n, freq='3s')
+    return df
+
+def _run_quiet(strategy, df: pd.DataFrame, **kwargs) -> Backtesting:
+    """运行回测并屏蔽策略的逐笔打印"""
+    backtest = Backtesting(strategy, df, **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest.run()
+    return backtest
+
+def test_subclass_on_bar_is_called():
+    """改写了 on_bar 的子类不能被父类的批量信号路径绕过；显式 vectorized = True 时才启用"""
+    class NeverTrade(MovingAverageStrategy):
+        def on_bar(self, bar):
+            pass
+
+    class OptIn(NeverTrade):
+        vectorized = True
+
+    df = _random_quotes(2000)
+    parent = _run_quiet(MovingAverageStrategy(5, 20), df)
+    assert parent.broker.trades
+    assert _run_quiet(NeverTrade(5, 20), df).broker.trades == []
+    assert _run_quiet(OptIn(5, 20), df).broker.trades == parent.broker.trades
+
+def test_subclass_on_bar_runs_every_bar():
+    """改写了 on_bar 的子类每根 bar 都被调用，不只在父类的交叉 bar 上（signal_bars 不适用）"""
+    class CountingStrategy(MovingAverageStrategy):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.calls = 0
+
+        def on_bar(self, bar):
+            self.calls += 1
+            super().on_bar(bar)
+
+    df = _random_quotes(2000)
+    counting = CountingStrategy(5, 20)
+    backtest = _run_quiet(counting, df)
+    assert counting.calls == len(df)
+    # 逐 bar 调用父类 on_bar，结果与父类本身一致
+    parent = _run_quiet(MovingAverageStrategy(5, 20), df)
+    assert backtest.broker.trades == parent.broker.trades
+    pd.testing.assert_frame_equal(backtest.results(), parent.results())
+
+def _flat_quotes(n: int, seed: int = 0) -> pd.DataFrame:
+    """大部分 bar 价格不变的行情：短/长均线在价格持平时是否相等，决定会不会凭空出现交叉"""
+    rng = np.random.default_rng(seed)
+    df = _random_quotes(n, seed)
+    close = np.round(10 + np.cumsum(rng.choice([0.0] * 8 + [0.01, -0.01], n)), 2)
+    return df.assign(成交价=close, 最高价=close + 0.01, 最低价=close - 0.01)
+
+def test_per_bar_matches_prepared():
+    """未经 prepare 的逐 bar 均线与 prepare 预先算好的均线逐位一致，成交完全相同"""
+    class PerBar(MovingAverageStrategy):
+        def prepare(self, df):
+            return df
+
+        def on_bar(self, bar):
+            assert "ma_long" not in bar
+            super().on_bar(bar)
+
+    for df in (_random_quotes(5000), _flat_quotes(20000)):
+        per_bar = _run_quiet(PerBar(5, 20), df)
+        prepared = _run_quiet(MovingAverageStrategy(5, 20), df)
+        assert prepared.broker.trades
+        assert per_bar.broker.trades == prepared.broker.trades
+        pd.testing.assert_frame_equal(per_bar.results(), prepared.results(), check_exact=True)
+
+def test_signal_bars_only_when_on_bars_declines():
+    """on_bars 给出信号时不再计算 signal_bars；on_bars 不适用（返回 None）时才用 signal_bars"""
+    class Counting(MovingAverageStrategy):
+        vectorized = True
+        batch = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.signal_bar_calls = 0
+
+        def on_bars(self, close, dt, symbols):
+            return super().on_bars(close, dt, symbols) if self.batch else None
+
+        def signal_bars(self, df):
+            self.signal_bar_calls += 1
+            return super().signal_bars(df)
+
+    class SignalsOnly(Counting):
+        batch = False
+
+    df = _random_quotes(2000)
+    expected = _run_quiet(MovingAverageStrategy(5, 20), df).broker.trades
+    for cls, calls in ((Counting, 0), (SignalsOnly, 1)):
+        strategy = cls(5, 20)
+        backtest = Backtesting(strategy, df)
+        assert strategy.signal_bar_calls == 0  # 构造时不计算
+        with contextlib.redirect_stdout(io.StringIO()):
+            backtest.run()
+        assert strategy.signal_bar_calls == calls
+        assert backtest.broker.trades == expected
+
+def test_rolling_mean_exact():
+    """O(N) 的窗口均值与逐窗口精确求和（math.fsum）逐位一致"""
+    import math
+
+    rng = np.random.default_rng(4)
+    n = 3000
+    series = [
+        _random_quotes(n)['成交价'].to_numpy(),
+        rng.uniform(0.01, 3000, n),                                   # 跨度大：高低两段求和
+        rng.normal(0, 5, n),                                          # 正负混合
+        np.where(rng.random(n) < 0.3, 0.0, rng.uniform(1, 2, n)),     # 含 0
+        np.where(rng.random(n) < 0.01, np.nan, rng.uniform(1, 2, n)), # 含 NaN
+        np.concatenate([[1e-300], rng.uniform(1, 2, n - 1)]),         # 指数跨度过大：逐窗口求和
+    ]
+    for close in series:
+        for window in (1, 5, 20, 240):
+            expected = np.full(n, np.nan)
+            expected[window - 1:] = [math.fsum(close[i:i + window]) / window for i in range(n - window + 1)]
+            np.testing.assert_array_equal(MovingAverageStrategy._rolling_mean(close, window), expected)
+
+    # 默认的 5 / 20 窗口：任何两位小数价格持平时短/长均线都相等，不会凭空交叉（np.mean 逐个累加时约六成不等）
+    for p in np.round(np.arange(1, 100000, 7) / 100, 2):
+        ma_short, ma_long = MovingAverageStrategy.precompute(np.full(20, p), 5, 20)
+        assert ma_short[-1] == ma_long[-1]
+
+def test_empty_data():
+    """空数据不报错，返回空结果"""
+    for df in (pd.DataFrame(), _random_quotes(10).iloc[:0]):
+        backtest = _run_quiet(MovingAverageStrategy(5, 20), df)
+        assert backtest.results().empty
+        assert list(backtest.results().columns) == ["timestamp", "equity", "cash", "close"]
+        assert backtest.broker.trades == []
+
+def test_broker_views_are_read_only():
+    """positions / orders 是快照：写入直接报错，而不是静默修改副本"""
+    broker = Broker(initial_cash=100000)
+    broker.submit_order("BUY", "000001.SZ", 10.0, 100, "MARKET")
+    broker.execute_orders({"symbol": "000001.SZ", "close": 10.0, "high": 10.0, "low": 10.0,
+                           "datetime": pd.Timestamp("2025-01-02 09:30:00")})
+    assert broker.positions["000001.SZ"]["quantity"] == 100
+    for view, key, value in ((broker.positions["000001.SZ"], "quantity", 0),
+                             (broker.positions, "000002.SZ", {}),
+                             (broker.orders[0], "status", "OPEN")):
+        try:
+            view[key] = value
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("只读视图被写入")
+    broker.update_position("000001.SZ", {"quantity": 0, "avg_price": 0.0})
+    assert broker.get_position("000001.SZ")["quantity"] == 0
+
+class _ReferenceBroker:
+    """逐订单 dict 撮合的原始实现，作为对照：改写后的 Broker 必须与它逐位一致"""
+
+    def __init__(self, initial_cash: float, fee_rate: float = 0.0005, slippage: float = 0.0001):
+        self.cash = initial_cash
+        self.positions = {}
+        self.orders = []
+        self.trades = []
+        self.fee_rate = fee_rate
+        self.slippage = slippage
+
+    def submit_order(self, side, symbol, price, qty, order_type):
+        self.orders.append({"id": len(self.orders), "side": side, "symbol": symbol, "price": price,
+                            "quantity": qty, "type": order_type, "status": "OPEN"})
+
+    def cancel_order(self, order_id):
+        for order in self.orders:
+            if order["id"] == order_id and order["status"] == "OPEN":
+                order["status"] = "CANCELED"
+                return True
+        return False
+
+    def execute_orders(self, bar):
+        for order in [o for o in self.orders if o["status"] == "OPEN"]:
+            symbol = order["symbol"]
+            if order["type"] == "MARKET":
+                match_price = bar["close"] * (1 + self.slippage if order["side"] == "BUY"
+                                              else 1 - self.slippage)
+            elif (order["side"] == "BUY" and order["price"] >= bar["low"]) or \
+                    (order["side"] == "SELL" and order["price"] <= bar["high"]):
+                match_price = order["price"]
+            else:
+                continue
+
+            cost = match_price * order["quantity"]
+            fee = cost * self.fee_rate
+            pos = self.positions.get(symbol, {"quantity": 0, "avg_price": 0.0})
+            if order["side"] == "BUY" and self.cash >= (cost + fee):
+                self.cash -= (cost + fee)
+                total_qty = pos["quantity"] + order["quantity"]
+                if total_qty > 0:
+                    pos["avg_price"] = (pos["avg_price"] * pos["quantity"] +
+                                        match_price * order["quantity"]) / total_qty
+                pos["quantity"] = total_qty
+                order["status"] = "FILLED"
+            elif order["side"] == "SELL" and pos["quantity"] >= order["quantity"]:
+                self.cash += (cost - fee)
+                pos["quantity"] -= order["quantity"]
+                order["status"] = "FILLED"
+
+            if order["status"] == "FILLED":
+                self.positions[symbol] = pos
+                self.trades.append({"order_id": order["id"], "symbol": symbol, "side": order["side"],
+                                    "price": match_price, "quantity": order["quantity"], "fee": fee,
+                                    "timestamp": bar.get("datetime")})
+
+def test_broker_matches_reference():
+    """随机的限价 / 市价、买 / 卖、撤单场景下，Broker 与原始逐订单实现的成交、现金、持仓、订单状态逐位一致"""
+    rng = np.random.default_rng(1)
+    symbols = ["000001.SZ", "000002.SZ"]
+    broker, reference = Broker(initial_cash=20000), _ReferenceBroker(20000)
+    for i in range(300):
+        close = float(np.round(10 + rng.normal(0, 0.2), 2))
+        for _ in range(rng.integers(0, 4)):
+            side = "BUY" if rng.random() < 0.55 else "SELL"
+            order_type = "LIMIT" if rng.random() < 0.6 else "MARKET"
+            args = (side, symbols[rng.integers(2)], float(np.round(close + rng.normal(0, 0.1), 2)),
+                    float(rng.integers(1, 10) * 100), order_type)
+            broker.submit_order(*args)
+            reference.submit_order(*args)
+        if reference.orders and rng.random() < 0.1:
+            order_id = int(rng.integers(len(reference.orders)))
+            assert broker.cancel_order(order_id) == reference.cancel_order(order_id)
+        bar = {"close": close, "high": close + 0.05, "low": close - 0.05,
+               "datetime": pd.Timestamp("2025-01-02 09:30:00") + pd.Timedelta(seconds=3 * i)}
+        broker.execute_orders(bar)
+        reference.execute_orders(bar)
+
+        assert broker.cash == reference.cash
+        assert broker.trades == reference.trades
+        assert {s: dict(p) for s, p in broker.positions.items()} == reference.positions
+        assert [dict(o) for o in broker.orders] == reference.orders
+    statuses = {o["status"] for o in reference.orders}
+    assert statuses == {"OPEN", "FILLED", "CANCELED"}
+    assert {t["side"] for t in reference.trades} == {"BUY", "SELL"}
+
+def test_ma_cross_kernel_matches_backtesting():
+    """MovingAverageStrategy 的编译内核回测与通用 Backtesting 引擎结果一致"""
+    from backtest.Analysis import BacktestAnalysis
+    from backtest.utils import _ma_cross_jit
+
+    for df in (_random_quotes(5000, seed=2), _flat_quotes(20000, seed=2)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            analysis = _ma_cross_jit(MovingAverageStrategy(5, 20), df, 100000)
+        backtest = _run_quiet(MovingAverageStrategy(5, 20), df, initial_cash=100000)
+        expected = BacktestAnalysis(backtest.results(), backtest.broker.trades, 100000)
+
+        assert analysis is not None and analysis.trades
+        assert analysis.trades == expected.trades
+        pd.testing.assert_frame_equal(analysis.results_df, expected.results_df, check_exact=True)
+
+    # 满仓买入时买单可能无法当根成交（Backtesting 转为逐 bar 运行），内核放弃并交给调用方回退
+    class AllIn(MovingAverageStrategy):
+        cash_fraction = 1.0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert _ma_cross_jit(AllIn(5, 20), df, 100000) is None
+        # 多标的数据同样交给通用引擎
+        two_symbols = pd.concat([df, df.assign(万得代码='000002.SZ')])
+        assert _ma_cross_jit(MovingAverageStrategy(5, 20), two_symbols, 100000) is None
+
+def test_portfolio_output_follows_headers():
+    """多进程组合回测：每只股票的输出紧跟在它自己的标题之后，按 data_dict 顺序"""
+    from backtest.utils import create_portfolio_backtest
+
+    symbols = ['000001.SZ', '000002.SZ', '000003.SZ']
+    data_dict = {s: _random_quotes(2000, seed=i).assign(万得代码=s) for i, s in enumerate(symbols)}
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results = create_portfolio_backtest(MovingAverageStrategy, data_dict, max_workers=2,
+                                            short_window=5, long_window=20)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sequential = create_portfolio_backtest(MovingAverageStrategy, data_dict, max_workers=1,
+                                               short_window=5, long_window=20)
+
+    blocks = output.getvalue().split("\n=== 回测 ")[1:]
+    assert [b.split(" ===")[0] for b in blocks] == symbols
+    for symbol, block in zip(symbols, blocks):
+        assert "移动平均线策略初始化" in block and "移动平均线策略回测完成" in block
+        assert results[symbol].trades == sequential[symbol].trades
+
 if __name__ == "__main__":
     print("开始测试回测框架适配...\n")
     
-    test_data_adapter()
-    test_backtest_integration()
+    try:
+        db = QuantDatabase(read_only=True)
+    except duckdb.IOException:
+        db = None
+    test_data_adapter(db)
+    if db is not None:
+        test_backtest_integration(db)
+        db.close()
     
     print("所有测试完成！")
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+测试数据库查询侧的时间解析（不依赖数据库文件）
+"""
+
+import sys
+import os
+import io
+import contextlib
+import datetime as dt
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import duckdb
+import database
+from database import QuantDatabase
+import numpy as np
+import pandas as pd
+
+# 合法的 6 / 7~9 位时间，混入长度不对、时分秒越界的非法值
+TIMES = [93003, 93003000, 145959999, 100000, 235959, 1234567890, 0, 7, 10300123456,
+         240000, 96000, 93060123]
+STR_TIMES = ["093003", "93003000", "93003000.0", "145959999", "", "abc", "-93003000",
+             "1234567890123456789012", "240000", "96000", "100000", "7"]
+
+def _time_frames():
+    """两个交易日（倒序）× 整数 / 含 NaN 的浮点 / 字符串三种 时间 列"""
+    dates = [dt.date(2025, 1, 3), dt.date(2025, 1, 2)]
+    for col in (pd.Series(TIMES * 2, dtype="int64"),
+                pd.Series(TIMES * 2, dtype="float64").where(lambda s: s != 7),
+                pd.Series(STR_TIMES * 2)):
+        yield pd.DataFrame({"trade_date": np.repeat(dates, len(col) // 2), "时间": col,
+                            "x": range(len(col))})
+
+def test_datetime_sql_matches_pandas():
+    """SQL 里拼接的 datetime 与 pandas 解析（含非法时间的剔除与排序）一致"""
+    for df in _time_frames():
+        con = duckdb.connect()
+        con.register("t", df)
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = QuantDatabase._attach_datetime_index(df.copy())
+            got = QuantDatabase._set_sql_datetime_index(
+                con.execute(QuantDatabase._datetime_sql("SELECT * FROM t")).df())
+        con.close()
+
+        assert len(expected) > 0
+        assert got.index.tolist() == expected.index.tolist()
+        assert got["x"].tolist() == expected["x"].tolist()
+
+def _reference_datetime(date: dt.date, raw):
+    """逐行按字符串规则解析（int64 向量化之前的做法）：去空白、去 .0、只留数字，6 位为 HHMMSS，更长的末 3 位为毫秒"""
+    digits = "".join(ch for ch in str(raw).strip().removesuffix(".0") if ch.isdigit())
+    if len(digits) < 6:
+        return None
+    hms, ms = (digits, "000") if len(digits) == 6 else (digits[:-3].zfill(6), digits[-3:])
+    try:
+        return dt.datetime.combine(date, dt.time(int(hms[0:2]), int(hms[2:4]), int(hms[4:6]),
+                                                 int(ms) * 1000))
+    except ValueError:  # 时分秒越界
+        return None
+
+def test_attach_datetime_index_matches_string_parse():
+    """int64 整除 / 取模得到的时间与逐行字符串解析一致；非法行丢弃，结果按时间稳定排序"""
+    rng = np.random.default_rng(0)
+    secs = rng.integers(9 * 3600, 15 * 3600, 2000)
+    hhmmss = secs // 3600 * 10000 + secs // 60 % 60 * 100 + secs % 60
+    times = np.where(rng.random(2000) < 0.5, hhmmss, hhmmss * 1000 + rng.integers(0, 1000, 2000))
+    dates = rng.choice([dt.date(2025, 1, 3), dt.date(2025, 1, 2)], 2000)
+    frames = list(_time_frames())
+    for col in (pd.Series(times), pd.Series(times.astype(str)), pd.Series(times.astype(float))):
+        frames.append(pd.DataFrame({"trade_date": dates, "时间": col, "x": range(len(col))}))
+
+    for df in frames:
+        parsed = [_reference_datetime(d, t) for d, t in zip(df["trade_date"], df["时间"])]
+        expected = sorted((p, x) for p, x in zip(parsed, df["x"]) if p is not None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            got = QuantDatabase._attach_datetime_index(df.copy())
+
+        assert expected
+        assert got.index.tolist() == [pd.Timestamp(p) for p, _ in expected]
+        assert got["x"].tolist() == [x for _, x in expected]
+
+def test_load_quotes_cache_isolated(tmp_path, monkeypatch):
+    """缓存命中返回的结果被调用方原地修改后，之后的查询仍得到原始数据"""
+    db_path = tmp_path / "quant.duckdb"
+    con = duckdb.connect(str(db_path))
+    con.execute("""
+        CREATE TABLE quotes AS
+        SELECT '000001.SZ' AS 万得代码, DATE '2025-01-02' AS trade_date,
+               93000000 + i * 1000 AS 时间, 10.0 + i / 100 AS 成交价
+        FROM range(10) t(i)
+    """)
+    con.close()
+
+    database.clear_quotes_cache()
+    for copy_on_write in (True, False):
+        # 没有写时复制的 pandas（2.x）上必须拿到深拷贝
+        monkeypatch.setattr(database, "_copy_on_write", lambda: copy_on_write)
+        db = QuantDatabase(db_path, read_only=True, parquet_root=tmp_path / "none")
+        first = db.load_quotes("000001.SZ", "2025-01-02", "2025-01-02")
+        expected = first.copy()
+        first.iloc[0, first.columns.get_loc("成交价")] = -1.0
+        first["成交价"] *= 2
+        second = db.load_quotes("000001.SZ", "2025-01-02", "2025-01-02")
+        db.close()
+
+        pd.testing.assert_frame_equal(second, expected)
+        cached = next(iter(database._QUOTES_CACHE.values()))
+        assert np.shares_memory(second["成交价"].to_numpy(), cached["成交价"].to_numpy()) == copy_on_write
+    database.clear_quotes_cache()
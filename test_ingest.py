@@ -0,0 +1,138 @@
+"""
+测试 CSV 导入（在临时目录里生成小的 CSV 夹具，不依赖数据目录和数据库文件）
+"""
+
+import sys
+import os
+import io
+import contextlib
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import duckdb
+import ingest
+import numpy as np
+import pandas as pd
+
+def _write_csv_fixture(root, header_row: bool) -> None:
+    """
+    两只股票各一天的 GBK 行情 CSV（含 6 / 9 位时间、0 成交行、整列为空的列和空列名列；
+    header_row 时中间夹一行重复表头）
+    """
+    rng = np.random.default_rng(3)
+    for symbol in ("000001.SZ", "000002.SZ"):
+        n = 50
+        secs = 9 * 3600 + 30 * 60 + np.arange(n) * 3
+        hh, mm, ss = secs // 3600, secs // 60 % 60, secs % 60
+        t = (hh * 10000000 + mm * 100000 + ss * 1000).astype(object)
+        t[::7] = (hh * 10000 + mm * 100 + ss)[::7]
+        px = np.round(10 + np.cumsum(rng.normal(0, 0.01, n)), 2)
+        df = pd.DataFrame({
+            "万得代码": symbol, "交易所代码": symbol[:6], "自然日": 20250102, "时间": t,
+            "成交价": px, "成交量": rng.integers(0, 5000, n), "成交额": np.round(px * 1000, 2),
+            "成交笔数": rng.integers(1, 50, n), "最高价": px + 0.05, "最低价": px - 0.05,
+        })
+        df.loc[5, "成交量"] = 0
+        out = df.astype(object)
+        if header_row:
+            header = pd.DataFrame([dict(zip(df.columns, df.columns))])
+            out = pd.concat([out.iloc[:20], header, out.iloc[20:]])
+        out["备注"] = ""
+        out["Unnamed: 11"] = ""
+        path = root / "20250102" / symbol
+        path.mkdir(parents=True)
+        out.to_csv(path / "行情.csv", index=False, encoding="gbk")
+
+def _ingest_quotes(tmp_path, monkeypatch, header_row: bool) -> dict:
+    """按两种导入引擎分别把 CSV 夹具导入各自的数据库，返回 {engine: 排好序的 quotes 表}"""
+    data_root = tmp_path / f"data_{header_row}"
+    _write_csv_fixture(data_root, header_row)
+    monkeypatch.setattr(ingest, "DATA_ROOT", data_root)
+    tables = {}
+    for engine in ("pandas", "duckdb"):
+        con = duckdb.connect(str(tmp_path / f"{engine}_{header_row}.duckdb"))
+        ingest.ensure_import_log(con)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert ingest.ingest_category(con, "行情.csv", "quotes", ingest.load_quotes_csv, True,
+                                          engine, ingest.QUOTE_TRADE_COLS) == 2
+        tables[engine] = con.execute(
+            "SELECT * FROM quotes ORDER BY 万得代码, trade_date, 时间").df()
+        con.close()
+    return tables
+
+def test_ingest_engines_match(tmp_path, monkeypatch):
+    """同一批 CSV 用 pandas / duckdb 两种导入引擎写入的 quotes 表完全一致"""
+    tables = _ingest_quotes(tmp_path, monkeypatch, header_row=False)
+    assert len(tables["pandas"]) == 98  # 每个文件剔除了 1 条 0 成交行
+    pd.testing.assert_frame_equal(tables["duckdb"], tables["pandas"], check_exact=True)
+
+def test_ingest_engines_header_row(tmp_path, monkeypatch):
+    """
+    文件中间有重复表头时 pandas 引擎整列按文本存储，duckdb 引擎在剔除表头行后由 SQL 推断类型：
+    列类型可以不同，但两者剔除的行与各列的值一致
+    """
+    tables = _ingest_quotes(tmp_path, monkeypatch, header_row=True)
+    pandas_table, duckdb_table = tables["pandas"], tables["duckdb"]
+    assert len(pandas_table) == 98
+    casts = {col: dtype for col, dtype in duckdb_table.dtypes.items()
+             if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_numeric_dtype(pandas_table[col])}
+    assert "时间" in casts
+    pandas_table = pandas_table.astype(casts).sort_values(["万得代码", "时间"], ignore_index=True)
+    pd.testing.assert_frame_equal(duckdb_table, pandas_table, check_exact=True)
+
+def _run_ingest_all(monkeypatch, data_root, db_path, parquet_root, full_rebuild: bool):
+    """用临时目录的配置运行一次 ingest_all"""
+    for name, value in (("DATA_ROOT", data_root), ("DB_PATH", db_path), ("FULL_REBUILD", full_rebuild),
+                        ("IMPORT_ENGINE", "pandas"), ("IMPORT_PROCESSES", False),
+                        ("PARQUET_ROOT", parquet_root)):
+        monkeypatch.setattr(ingest, name, value)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.ingest_all()
+
+def test_parquet_export_only_after_import(tmp_path, monkeypatch):
+    """增量导入没有新文件时不重写 Parquet 分区；有文件导入时才重新导出"""
+    data_root, db_path, parquet_root = tmp_path / "data", tmp_path / "quant.duckdb", tmp_path / "pq"
+    _write_csv_fixture(data_root, header_row=False)
+    _run_ingest_all(monkeypatch, data_root, db_path, parquet_root, full_rebuild=True)
+    files = sorted((parquet_root / "quotes").rglob("*.parquet"))
+    assert files
+    mtimes = [f.stat().st_mtime_ns for f in files]
+
+    _run_ingest_all(monkeypatch, data_root, db_path, parquet_root, full_rebuild=False)
+    assert [f.stat().st_mtime_ns for f in files] == mtimes
+
+    # 修改过的 CSV 会被重新导入，随后整表重新导出
+    csv_file = next(data_root.rglob("行情.csv"))
+    os.utime(csv_file, ns=(csv_file.stat().st_atime_ns, csv_file.stat().st_mtime_ns + 10**9))
+    _run_ingest_all(monkeypatch, data_root, db_path, parquet_root, full_rebuild=False)
+    files = sorted((parquet_root / "quotes").rglob("*.parquet"))
+    assert files and [f.stat().st_mtime_ns for f in files] != mtimes
+
+def test_id_columns_keep_text(tmp_path, monkeypatch):
+    """编号/代码类列按原文保存（保留前导零）；整列为空的列与 pandas 解析器一致按 DOUBLE 建表"""
+    for table in _ingest_quotes(tmp_path, monkeypatch, header_row=False).values():
+        assert sorted(table["交易所代码"].unique()) == ["000001", "000002"]
+        assert table["备注"].dtype == np.float64 and table["备注"].isna().all()
+
+def test_incremental_import_requires_rebuild(tmp_path, monkeypatch):
+    """旧格式（没有 import_meta 版本记录）的库不能增量导入，全量重建后恢复正常"""
+    data_root, db_path = tmp_path / "data", tmp_path / "quant.duckdb"
+    _write_csv_fixture(data_root, header_row=False)
+    _run_ingest_all(monkeypatch, data_root, db_path, None, full_rebuild=True)
+    _run_ingest_all(monkeypatch, data_root, db_path, None, full_rebuild=False)
+
+    # 模拟旧版本导入的库
+    con = duckdb.connect(str(db_path))
+    con.execute("DROP TABLE import_meta")
+    con.close()
+    try:
+        _run_ingest_all(monkeypatch, data_root, db_path, None, full_rebuild=False)
+    except RuntimeError as e:
+        assert "full_rebuild" in str(e)
+    else:
+        raise AssertionError("旧格式的库被增量导入")
+
+    _run_ingest_all(monkeypatch, data_root, db_path, None, full_rebuild=True)
+    _run_ingest_all(monkeypatch, data_root, db_path, None, full_rebuild=False)
+    con = duckdb.connect(str(db_path), read_only=True)
+    assert con.execute("SELECT count(*) FROM quotes").fetchone()[0] == 98
+    con.close()